@@ -3,6 +3,9 @@ import os.path
 import platform
 import copy
 import itertools
+import hashlib
+import logging
+from collections import OrderedDict
 
 #PySide2 imports
 from PySide2 import QtCore, QtGui
@@ -15,16 +18,13 @@ import numpy as np
 import pandas as pd
 from scipy import __version__ as scipy_version
 import scipy.signal as scsig
-from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+# openpyxl and the analysis dialogs are imported when they are first used, for faster startup
 
 #SAFT imports
 from clicker import clickAlgebra
-from extractPeakResponses import extractPeaksDialog
-from fitHistograms import histogramFitDialog
-from processGroupedPeaks import groupPeakDialog
 from quantal import fit_nGaussians, nGaussians_display
 from baselines import savitzky_golay, baseline_als, baselineIterator
+from peaks_cwt import find_peaks_cwt, removeSmallPeaks
 from dataStructures import Store, Dataset, Results, HistogramsR
 from helpMessages import gettingStarted
 import utils            #addFileSuffix, findCurve, findScatter etc
@@ -33,6 +33,22 @@ import utils            #addFileSuffix, findCurve, findScatter etc
 #Import pg last to avoid namespace-overwrite problems?
 import pyqtgraph as pg
 
+__version__ = "v. 0.4"
+
+# details of every GUI update go to the debug log, so they cost nothing unless asked for
+logger = logging.getLogger("SAFT")
+
+# the versions and platform don't change while running, so the about text is made once
+aboutText = """ ----*- SAFT {0} -*----
+        \nSemi-Automatic Fluorescence Trace analysis
+        \nAndrew Plested FMP- and HU-Berlin 2020
+        \nThis application can analyse sets of fluorescence time series.
+        \nIt makes heavy use of PyQtGraph ({8}, Luke Campagnola).
+        \nPython {1}
+        \nPandas {2}, Numpy {3}, SciPy {4}
+        \nPySide2 {5} built on Qt {6}
+        \nRunning on {7}
+        """.format(__version__, platform.python_version(), pd.__version__, np.__version__, scipy_version, pyside_version, QtCore.__version__, platform.platform(), pg.__version__)
 
 class QHLine(QFrame):
     ### from https://stackoverflow.com/questions/5671354
@@ -71,19 +87,37 @@ class SAFTMainWindow(QMainWindow):
         self.split_traces = False
         self.LR_created = False                 # was a pg linear region created yet?
         self.wasManualOnce = False              # was manual editing of peaks ever engaged?
-        self.simplePeaks = False                # choice of peak finding algorithm
+        self.simplePeaks = True                 # choice of peak finding algorithm, simple is faster than wavelet
         self.autoPeaks = True                   # find peaks automatically or manually
         self.cwt_width = 5                      # width of the continuous wavelet transform peak finding
+        self.cwtRidges = False                  # wavelet transform with ridge line search ('wavelet' in the GUI)
+        self.cwt_SNR = 1.3                      # SNR (wavelet) or prominence (simple) for peak finding
+        self.removeSml = 30                     # cut off for small peaks, in % of the largest (wavelet)
+        self.peakCache = OrderedDict()          # automatic peaks for recently seen traces and settings
+        self.peakCacheSize = 64
+        self.stageCache = {}                    # baselined and smoothed traces of the ROI on show, by condition
+        self.p1Items = {}                       # curve, peak scatter and baseline items in p1 for each condition
+        self.p1stackItems = {}                  # and in the split traces
+        self.histNbins = None                   # histogram settings, read from the GUI only when they change
+        self.histMax = None
+        self.histInvDx = None                   # bins per unit dF/F
+        self.histBins = None                    # bin edges and centres
         
         self.store = Store()                    # store for the datasets not being analysed
         self.dataLoaded = False                 # was any data loaded yet?
         self.pauseUpdates = False               # should updates be paused whilst we make a lot of changes to GUI?
         self.noCrosshair = True                 # is there any crosshair shown?
+        self.p3CurveX = None                    # x and y data of the trace in p3, kept for the crosshair
+        self.p3CurveY = None
+        self.p3dt = None                        # sample interval of the p3 trace, None if not uniform
+        self.p3lastIdx = None                   # sample under the crosshair at the last mouse move
         self.workingDataset = Dataset("Empty")  # unnamed, empty dataset for traces, pk results and GUI settings
         self.workingDataset.ROI_list = None
         self.filename = None
         
         self.conditions = []                    # conditions will be sheet names from xlsx
+        self.pens = []                          # pens and brushes for each condition, made once per load
+        self.brushes = []
         self.datasetList_CBX = ['-']            # maintain our own list of datasets from the combobox
         self.extPa = {}                         # external parameters for the peak scraping dialog
         self.dataLock = True                    # when manual peak editing, lock to trace data
@@ -118,17 +152,7 @@ class SAFTMainWindow(QMainWindow):
     
     
     def about(self):
-        QMessageBox.about (self, "About SAFT",
-        """ ----*- SAFT {0} -*----
-        \nSemi-Automatic Fluorescence Trace analysis
-        \nAndrew Plested FMP- and HU-Berlin 2020
-        \nThis application can analyse sets of fluorescence time series.
-        \nIt makes heavy use of PyQtGraph ({8}, Luke Campagnola).
-        \nPython {1}
-        \nPandas {2}, Numpy {3}, SciPy {4}
-        \nPySide2 {5} built on Qt {6}
-        \nRunning on {7}
-        """.format(__version__, platform.python_version(), pd.__version__, np.__version__, scipy_version, pyside_version, QtCore.__version__, platform.platform(), pg.__version__))
+        QMessageBox.about (self, "About SAFT", aboutText)
     
     def modalWarning(self, s):
         #print("click", s)
@@ -149,11 +173,17 @@ class SAFTMainWindow(QMainWindow):
         
         # Store the plot items in a list - can't seem to get them easily otherwise?
         data = []
+        # remove the plots (and their trace items) of any earlier data
+        self.p1stack.clear()
+        self.p1stackItems = {}
         self.p1stackMembers = []
         for c in self.conditions:
             memberName = c + " trace"
             p1_stack_member = self.p1stack.addPlot(title=c, y=data, name=memberName)
             p1_stack_member.hideAxis('bottom')
+            # draw cost should follow the screen width rather than the trace length
+            p1_stack_member.setDownsampling(auto=True, mode='peak')
+            p1_stack_member.setClipToView(True)
             self.p1stackMembers.append(p1_stack_member)
             self.p1stack.nextRow()
             #print (c, len(self.p1stackMembers))
@@ -181,6 +211,9 @@ class SAFTMainWindow(QMainWindow):
         self.p1.setLabel('left', "dF / F")
         self.p1.setLabel('bottom', "Time (s)")
         self.p1.vb.setLimits(xMin=0)
+        # long traces are decimated (keeping peaks) to the visible pixels
+        self.p1.setDownsampling(auto=True, mode='peak')
+        self.p1.setClipToView(True)
         #just a blank for now, populate after loading data to get the right number of split graphs
         self.p1stack = pg.GraphicsLayout()
         
@@ -204,8 +237,16 @@ class SAFTMainWindow(QMainWindow):
         self.p3.setFixedWidth(550)
         self.p3vb = self.p3.vb
         
+        # linear region in p1 that sets the x-range of p3. made (and connected) only once,
+        # it is placed in p1 or the split traces when there is data.
+        self.lr = pg.LinearRegionItem([0, 1])
+        self.lr.setZValue(-10)
+        self.lrHost = None
+        self.lr.sigRegionChanged.connect(self.updateZoomRange)
+        self.p3.sigXRangeChanged.connect(self.updateRegion)
+        
         # draw the crosshair if we are in manual editing mode
-        self.p3proxyM = pg.SignalProxy(self.p3.scene().sigMouseMoved, rateLimit=60, slot=self.mouseMoved)
+        self.p3proxyM = pg.SignalProxy(self.p3.scene().sigMouseMoved, rateLimit=30, slot=self.mouseMoved)
         
         # what does this do??
         self.p3.scene().sigMouseClicked.connect(self.clickRelay)
@@ -242,27 +283,35 @@ class SAFTMainWindow(QMainWindow):
     def createLinearRegion(self):
         """Linear region in p1 that defines the x-region in p3 (manual editing window)"""
         # taken from pyqtgraph examples.
+        # the region item is reused, so only its position is set here
         
         if self.LR_created == False:
             self.LR_created = True
             xrange = self.ranges['xmax']-self.ranges['xmin']
-            self.lr = pg.LinearRegionItem([xrange/2, xrange/1.5])
-            self.lr.setZValue(-10)
-    
-        def updatePlot():
-            self.p3.setXRange(*self.lr.getRegion(), padding=0)
-        def updateRegion():
-            self.lr.setRegion(self.p3.getViewBox().viewRange()[0])
-        
-        self.lr.sigRegionChanged.connect(updatePlot)
-        self.p3.sigXRangeChanged.connect(updateRegion)
+            self.lr.setRegion([xrange/2, xrange/1.5])
         
+        # an item can only be in one plot, for split traces use the bottom one
         if self.split_traces:
-            for s in self.p1stackMembers:
-                s.addItem(self.lr)
+            _target = self.p1stackMembers[-1]
         else:
-            self.p1.addItem(self.lr)
-        updatePlot()
+            _target = self.p1
+        
+        # the item is removed when its plot is cleared, otherwise move it
+        if self.lr not in _target.items:
+            if self.lrHost is not None and self.lr in self.lrHost.items:
+                self.lrHost.removeItem(self.lr)
+            _target.addItem(self.lr)
+            self.lrHost = _target
+        
+        self.updateZoomRange()
+    
+    def updateZoomRange(self):
+        """Linear region in p1 was moved, so p3 follows"""
+        self.p3.setXRange(*self.lr.getRegion(), padding=0)
+    
+    def updateRegion(self):
+        """p3 was zoomed or panned, so the linear region follows"""
+        self.lr.setRegion(self.p3.getViewBox().viewRange()[0])
     
     
     def mouseMoved(self, evt):
@@ -272,12 +321,28 @@ class SAFTMainWindow(QMainWindow):
             if self.p3.sceneBoundingRect().contains(pos):
                 mousePoint = self.p3vb.mapSceneToView(pos)
                 
-                # there should be two plot data items, find the curve data
-                _c = utils.findCurve(self.p3.items)
-                sx, sy = _c.getData()
-            
-                # quantize x to curve, and get corresponding y that is locked to curve
-                idx = np.abs(sx - mousePoint.x()).argmin()
+                # the curve data are stored whenever the p3 trace is drawn
+                sx = self.p3CurveX
+                sy = self.p3CurveY
+                if sx is None or len(sx) == 0:
+                    return
+                
+                # quantize x to curve (time is monotonic), and get corresponding y that is locked to curve
+                mx = mousePoint.x()
+                if self.p3dt:
+                    # regular sampling, so the index can be calculated directly
+                    idx = min(max(int(round((mx - sx[0]) / self.p3dt)), 0), len(sx) - 1)
+                else:
+                    idx = np.searchsorted(sx, mx)
+                    # searchsorted gives the insertion point, so check if the point to the left is closer
+                    if idx == len(sx) or (idx > 0 and mx - sx[idx - 1] < sx[idx] - mx):
+                        idx -= 1
+                
+                # still on the same sample, nothing to redraw
+                if idx == self.p3lastIdx:
+                    return
+                self.p3lastIdx = idx
+                
                 ch_x = sx[idx]
                 ch_y = sy[idx]
                 self.hLine.setPos(ch_y)
@@ -287,6 +352,19 @@ class SAFTMainWindow(QMainWindow):
                 self.plots.cursorlabel.setText("Cursor: x={: .2f}, y={: .3f}".format(ch_x, ch_y))
     
     
+    def setP3Curve(self, x, y):
+        """Keep the data of the trace drawn in p3 for the crosshair"""
+        self.p3CurveX = np.asarray(x)
+        self.p3CurveY = y
+        self.p3lastIdx = None
+        
+        # most traces are sampled regularly, check once here rather than on every mouse move
+        self.p3dt = None
+        if len(self.p3CurveX) > 1:
+            _dx = np.diff(self.p3CurveX)
+            if _dx[0] > 0 and np.ptp(_dx) <= 1e-6 * _dx[0]:
+                self.p3dt = _dx[0]
+    
     def splitState(self, b):
         """Called when trace display selection radio buttons are activated """
         if b.text() == "Split traces":
@@ -405,15 +483,17 @@ class SAFTMainWindow(QMainWindow):
         
         NBin_label = QtGui.QLabel("No. of bins")
         NBin_label.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
-        self.histo_NBin_Spin = pg.SpinBox(value=100, step=10, bounds=[0, 250], delay=0)
+        self.histo_NBin_Spin = pg.SpinBox(value=100, step=10, bounds=[0, 250], delay=0.2)
         self.histo_NBin_Spin.setFixedSize(60, 25)
-        self.histo_NBin_Spin.valueChanged.connect(self.updateHistograms)
+        self.histo_NBin_Spin.sigValueChanged.connect(self.setHistogramParams)
+        self.histo_NBin_Spin.sigValueChanged.connect(self.updateHistograms)
         
         histMax_label = QtGui.QLabel("dF/F max")
         histMax_label.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
-        self.histo_Max_Spin = pg.SpinBox(value=1, step=0.1, bounds=[0.1, 10], delay=0, int=False)
+        self.histo_Max_Spin = pg.SpinBox(value=1, step=0.1, bounds=[0.1, 10], delay=0.2, int=False)
         self.histo_Max_Spin.setFixedSize(60, 25)
-        self.histo_Max_Spin.valueChanged.connect(self.updateHistograms)
+        self.histo_Max_Spin.sigValueChanged.connect(self.setHistogramParams)
+        self.histo_Max_Spin.sigValueChanged.connect(self.updateHistograms)
         
         #toggle show ROI histogram sum
         histsum_label = QtGui.QLabel("Show histograms")
@@ -435,15 +515,15 @@ class SAFTMainWindow(QMainWindow):
         histnG_label = QtGui.QLabel("No. of Gaussians")
         histnG_label.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
         
-        self.histo_nG_Spin = pg.SpinBox(value=5, step=1, bounds=[1,10], delay=0, int=True)
+        self.histo_nG_Spin = pg.SpinBox(value=5, step=1, bounds=[1,10], delay=0.2, int=True)
         self.histo_nG_Spin.setFixedSize(60, 25)
-        self.histo_nG_Spin.valueChanged.connect(self.updateHistograms)
+        self.histo_nG_Spin.sigValueChanged.connect(self.updateHistograms)
         
         histq_label = QtGui.QLabel("dF ('q') guess")
         histq_label.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
-        self.histo_q_Spin = pg.SpinBox(value=.05, step=0.01, bounds=[0.01,1], delay=0, int=False)
+        self.histo_q_Spin = pg.SpinBox(value=.05, step=0.01, bounds=[0.01,1], delay=0.2, int=False)
         self.histo_q_Spin.setFixedSize(60, 25)
-        self.histo_q_Spin.valueChanged.connect(self.updateHistograms)
+        self.histo_q_Spin.sigValueChanged.connect(self.updateHistograms)
         
         self.saveHistogramsToggle = QCheckBox("Save Histograms", self)
         self.saveHistogramsToggle.setChecked(self.saveHistogramsOption)
@@ -561,6 +641,14 @@ class SAFTMainWindow(QMainWindow):
         self.autobs_Box.setFixedSize(70, 25)
         self.autobs_Box.currentIndexChanged.connect(self.ROI_Change)
         
+        # dragging a slider or stepping spin boxes emits many values, only update when
+        # the controls rest for 50 ms. Changes to several controls are also combined.
+        # (so the spin boxes that start this timer have no delay of their own)
+        self.updateTimer = QtCore.QTimer()
+        self.updateTimer.setSingleShot(True)
+        self.updateTimer.setInterval(50)
+        self.updateTimer.timeout.connect(self.ROI_Change)
+        
         # parameters for the auto baseline algorithm
         auto_bs_lam_label = QtGui.QLabel("lambda")
         auto_bs_lam_label.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
@@ -570,7 +658,7 @@ class SAFTMainWindow(QMainWindow):
         self.auto_bs_lam_slider.setMaximum(9)
         self.auto_bs_lam_slider.setValue(6)
         self.auto_bs_lam_slider.setFixedSize(100, 25)
-        self.auto_bs_lam_slider.valueChanged.connect(self.ROI_Change)
+        self.auto_bs_lam_slider.valueChanged.connect(lambda:self.updateTimer.start())
         
         auto_bs_P_label = QtGui.QLabel("p")
         auto_bs_P_label.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
@@ -580,7 +668,7 @@ class SAFTMainWindow(QMainWindow):
         self.auto_bs_P_slider.setTickPosition(QtGui.QSlider.TicksBothSides)
         self.auto_bs_P_slider.setValue(3)
         self.auto_bs_P_slider.setFixedSize(100, 25)
-        self.auto_bs_P_slider.valueChanged.connect(self.ROI_Change)
+        self.auto_bs_P_slider.valueChanged.connect(lambda:self.updateTimer.start())
         
         # Savitsky-Golay smoothing is very aggressive and doesn't work well in this case
         SGsmoothing_label = QtGui.QLabel("Savitzky-Golay smoothing")
@@ -596,7 +684,7 @@ class SAFTMainWindow(QMainWindow):
         
         self.SGWin_Spin = pg.SpinBox(value=15, step=2, bounds=[5, 49], delay=0, int=True)
         self.SGWin_Spin.setFixedSize(60, 25)
-        self.SGWin_Spin.valueChanged.connect(self.ROI_Change)
+        self.SGWin_Spin.sigValueChanged.connect(lambda:self.updateTimer.start())
         
         # should be inactive until extraction
         self.save_baselined_ROIs_Btn = QtGui.QPushButton('Save baselined ROI traces')
@@ -651,29 +739,30 @@ class SAFTMainWindow(QMainWindow):
         self.p3Selection.addItems(['-'])
         self.p3Selection.currentIndexChanged.connect(self.ROI_Change)
                 
-        # Toggle between wavelet transform and simple algorithm for peak finding
+        # Choose between wavelet transform, prominence and width, or simple algorithm for peak finding
         peakFind_L_label = QtGui.QLabel("Auto-find peaks with")
         peakFind_L_label.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
         peakFind_R_label = QtGui.QLabel("algorithm.")
         peakFind_R_label.setAlignment(QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter)
-        cwt_width_label = QtGui.QLabel("Width (wavelet only)")
+        cwt_width_label = QtGui.QLabel("Width / min. spacing")
         cwt_width_label.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
         SNR_label = QtGui.QLabel("Prominence / SNR")
         SNR_label.setAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
         
         self.peak_CB = pg.ComboBox()
         self.peak_CB.setFixedSize(90, 25)
-        self.peak_CB.addItems(['wavelet','simple'])
+        # 'SNR & width' is scipy find_peaks with prominence SNR x SD, quicker than the wavelet transform
+        self.peak_CB.addItems(['simple','wavelet','SNR & width'])
         self.peak_CB.currentIndexChanged.connect(self.ROI_Change)
         
         # spin boxes for CWT algorithm parameters
         self.cwt_SNR_Spin = pg.SpinBox(value=1.3, step=.1, bounds=[.1, 4], delay=0, int=False)
         self.cwt_SNR_Spin.setFixedSize(70, 25)
-        self.cwt_SNR_Spin.valueChanged.connect(self.ROI_Change)
+        self.cwt_SNR_Spin.sigValueChanged.connect(lambda:self.updateTimer.start())
         
         self.cwt_w_Spin = pg.SpinBox(value=6, step=1, bounds=[2, 20], delay=0, int=True)
         self.cwt_w_Spin.setFixedSize(70, 25)
-        self.cwt_w_Spin.valueChanged.connect(self.ROI_Change)
+        self.cwt_w_Spin.sigValueChanged.connect(lambda:self.updateTimer.start())
         
         # Control to exclude small peaks
         removeSml_L_label = QtGui.QLabel("Ignore peaks < ")
@@ -682,7 +771,7 @@ class SAFTMainWindow(QMainWindow):
         removeSml_R_label.setAlignment(QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter)
         self.removeSml_Spin = pg.SpinBox(value=30, step=10, bounds=[0, 100], suffix='%', delay=0, int=False)
         self.removeSml_Spin.setFixedSize(70, 25)
-        self.removeSml_Spin.valueChanged.connect(self.ROI_Change)
+        self.removeSml_Spin.sigValueChanged.connect(lambda:self.updateTimer.start())
         
         # should be inactive until peaks are extracted
         self.savePSRBtn = QtGui.QPushButton('Save peak data')
@@ -788,9 +877,28 @@ class SAFTMainWindow(QMainWindow):
         qmb.exec_()
     
     def histogram_parameters(self):
-        _nbins = int(self.histo_NBin_Spin.value())
-        _max = self.histo_Max_Spin.value()
-        return _nbins, _max
+        if self.histNbins is None:
+            self.setHistogramParams()
+        return self.histNbins, self.histMax
+    
+    def setHistogramParams(self):
+        """Read the histogram settings and make the regular bins, when the spin boxes change"""
+        self.histNbins = int(self.histo_NBin_Spin.value())
+        self.histMax = self.histo_Max_Spin.value()
+        self.histInvDx = self.histNbins / self.histMax
+        
+        _edges = np.linspace(0., self.histMax, self.histNbins + 1)
+        _centres = (np.arange(self.histNbins) + 0.5) / self.histInvDx
+        # shared between updates, so read only
+        _edges.setflags(write=False)
+        _centres.setflags(write=False)
+        self.histBins = (_edges, _centres)
+    
+    def histogramBins(self):
+        """Edges and centres of the regular histogram bins"""
+        if self.histBins is None:
+            self.setHistogramParams()
+        return self.histBins
     
        
     def doHistograms(self):
@@ -801,20 +909,25 @@ class SAFTMainWindow(QMainWindow):
         # create a dataframe to put the results in
         self.hDF = HistogramsR(self.workingDataset.ROI_list, _condList, _nbins, 0., _max)
         
-        maxVal = len (self.workingDataset.ROI_list) * len (_condList)
-        progMsg = "Histograms for {0} traces".format(maxVal)
-        
-        with pg.ProgressDialog(progMsg, 0, maxVal) as dlg:
+        #from the allowlist, should be from edited internal data?
+        # the peaks of every ROI in every condition side by side (NaN padded), so that
+        # all the histograms are made in one pass and added to the dataframe together
+        _pairs = []
+        _arrays = []
+        for _condi, _pdf in self.gpd.pk_extracted_by_condi.items():
+            logger.debug("Histograms for %s: %s", _condi, _pdf.columns)
+            _pairs += [(_ROI, _condi) for _ROI in _pdf.columns]
+            _arrays.append(_pdf.to_numpy(dtype=float))
+        
+        if _pairs:
+            _allPeaks = np.full((max(a.shape[0] for a in _arrays), len(_pairs)), np.nan)
+            _c = 0
+            for a in _arrays:
+                _allPeaks[:a.shape[0], _c:_c + a.shape[1]] = a
+                _c += a.shape[1]
             
-            #from the allowlist, should be from edited internal data?
-            for _condi, _pdf in self.gpd.pk_extracted_by_condi.items():
-                
-                print (_condi, _pdf.columns)
-                for _ROI in _pdf.columns:
-                    dlg += 1
-                    # calculate individual histograms and add to dataframe
-                    hy, hx = np.histogram(_pdf[_ROI], bins=_nbins, range=(0., _max))
-                    self.hDF.addHist(_ROI, _condi, hy)
+            print ("Histograms for {0} traces".format(len(_pairs)))
+            self.hDF.setHists(_pairs, utils.histogramColumns(_allPeaks, _nbins, _max))
                     
         # add sum columns
         self.hDF.ROI_sum()
@@ -822,32 +935,37 @@ class SAFTMainWindow(QMainWindow):
     def updateHistograms(self):
         """called when histogram controls are changed"""
         
+        # nothing to show before data is loaded, or whilst the GUI is being changed
+        if self.dataLoaded == False:
+            return
+        if self.pauseUpdates:
+            return
+        
         # get controls values and summarise to terminal
         _nbins, _max = self.histogram_parameters()
         _ROI = self.ROI_selectBox.currentText()
         _hsum = self.sum_hist.currentText()
-        print ('Update {3} Histogram(s) for {2} with Nbins = {0} and maximum dF/F = {1}.'.format(_nbins, _max, _ROI, _hsum))
+        logger.debug('Update %s Histogram(s) for %s with Nbins = %s and maximum dF/F = %s.', _hsum, _ROI, _nbins, _max)
        
         # clear
         self.p2.clear()
         
+        # bins are regular, so the edges are the same for every histogram
+        hx, _hxc = self.histogramBins()
+        
         if _hsum == "Separated":
             for i, _condi in enumerate(self.conditions):
-                # colours
-                col_series = (i, len(self.conditions))
                 # get relevant peaks data for displayed histograms
                 _, _pdata = self.workingDataset.resultsDF.getPeaks(_ROI, _condi)
-                # redo histogram
-                hy, hx  = np.histogram(_pdata, bins=_nbins, range=(0., _max))
+                # redo histogram, binned as the saved histograms are
+                hy = utils.histogramColumns(_pdata[:, None], _nbins, _max)[:, 0]
                 # replot
-                self.p2.plot(hx, hy, name="Histogram "+_condi, stepMode=True, fillLevel=0, pen=col_series, brush=col_series) ###fillOutline=True,
+                self.p2.plot(hx, hy, name="Histogram "+_condi, stepMode=True, fillLevel=0, pen=self.pens[i], brush=self.brushes[i]) ###fillOutline=True,
         
         elif _hsum == "Summed":
-            sumhy = np.zeros(_nbins)
-            for _condi in self.conditions:
-                _, _pdata = self.workingDataset.resultsDF.getPeaks(_ROI, _condi)
-                hy, hx  = np.histogram(_pdata, bins=_nbins, range=(0., _max))
-                sumhy += hy
+            # pool the peaks from all conditions and bin them in one pass
+            _pall = np.concatenate([self.workingDataset.resultsDF.getPeaks(_ROI, _condi)[1] for _condi in self.conditions])
+            sumhy = utils.histogramColumns(_pall[:, None], _nbins, _max)[:, 0]
             
             self.p2.plot(hx, sumhy, name="Summed histogram "+_ROI, stepMode=True, fillLevel=0, fillOutline=True, brush='y')
             
@@ -855,9 +973,8 @@ class SAFTMainWindow(QMainWindow):
                 #print ("len hx {}, hy {}".format(len(hx), len(hy)))
                 _num = self.histo_nG_Spin.value()
                 _q = self.histo_q_Spin.value()
-                _ws = self.histo_Max_Spin.value() / 20
+                _ws = _max / 20
                 
-                _hxc = np.mean(np.vstack([hx[0:-1], hx[1:]]), axis=0)
                 _opti = fit_nGaussians(_num, _q, _ws, sumhy, _hxc)
                 if _opti.success:
                     _hx_u, _hy_u = nGaussians_display (_hxc, _num, _opti.x)
@@ -867,23 +984,25 @@ class SAFTMainWindow(QMainWindow):
                     _c.setPen('w', width=3)
                     _c.setShadowPen(pg.mkPen((70,70,30), width=8, cosmetic=True))
                 else:
-                    print ("fit failed")
+                    logger.warning("fit failed")
         
        
     def datasetChange(self):
-        print ("a (dataset) change is coming")
+        logger.debug("a (dataset) change is coming")
         
         if self.datasetCBx.currentText() != self.workingDataset.DSname:
             # prep current data for store
             # store GUI settings?
-            self.store.storeSet(copy.copy(self.workingDataset))
-            print ('Stored {}'.format(self.workingDataset.DSname))
+            # no copy needed, the working dataset is replaced by the retrieved one below
+            self.store.storeSet(self.workingDataset)
+            logger.debug('Stored %s', self.workingDataset.DSname)
             
             self.workingDataset = self.store.retrieveWorkingSet(self.datasetCBx.currentText())
-            print ('Retrieved {}'.format(self.workingDataset.DSname))
+            self.stageCache = {}
+            logger.debug('Retrieved %s', self.workingDataset.DSname)
         
             # print GUI control dict
-            print ("swdsGC {}".format(self.workingDataset.GUIcontrols))
+            logger.debug("swdsGC %s", self.workingDataset.GUIcontrols)
             
             # do this first otherwise on ROI extracted peaks are overwritten
             # execute GUI controls specified in the retrieved Dataset
@@ -930,8 +1049,10 @@ class SAFTMainWindow(QMainWindow):
     def getGroups(self):
         """launch group processing dialog"""
         print ('Process grouped peaks from all ROIs.')
+        from processGroupedPeaks import groupPeakDialog
         self.getgroupsDialog = groupPeakDialog()
-        _dataset = copy.copy(self.workingDataset)
+        # only read from, so no copy is needed (decomposeRDF makes new frames)
+        _dataset = self.workingDataset
         ddf = utils.decomposeRDF(_dataset.resultsDF.df)
         self.getgroupsDialog.addData(ddf, name=_dataset.DSname)
         accepted = self.getgroupsDialog.exec_()
@@ -939,9 +1060,10 @@ class SAFTMainWindow(QMainWindow):
     def launchHistogramFit(self):
         """Wrapping function to launch histogram fit dialog"""
         print ('Dialog to obtain quantal parameters from histogram fits.')
+        from fitHistograms import histogramFitDialog
         self.hfd = histogramFitDialog()
-        #send current peak data
-        _dataset = copy.copy(self.workingDataset)
+        #send current peak data, only read from, so no copy is needed
+        _dataset = self.workingDataset
         
         ddf = utils.decomposeRDF(_dataset.resultsDF.df)
         self.hfd.addData(ddf, _dataset.DSname, _dataset.getSD(maskWidth=10))
@@ -953,11 +1075,12 @@ class SAFTMainWindow(QMainWindow):
         print ('Dialog for getting peaks from all ROIs according to reference pattern.')
         # if the QDialog object is instantiated in __init__, it persists in state....
         # do it here to get a fresh one each time.
+        from extractPeakResponses import extractPeaksDialog
         self.gpd = extractPeaksDialog()
         
         # pass the data into the get peaks dialog object
         # we do not want the original trace data modified
-        _dataset = copy.copy(self.workingDataset)
+        _traces = self.workingDataset.traces
         
         # automatically reduce baseline (could also do this interactively??)
         # baselineIterator includes a progress indicator.
@@ -969,19 +1092,23 @@ class SAFTMainWindow(QMainWindow):
                 # populate values for automatic baseline removal from GUI (unless 'Lock')
                 self.setBaselineParams()
             
-            _dataset.traces = baselineIterator(_dataset.traces, self.auto_bs_lam, self.auto_bs_P)
+            # returns new dataframes, the working traces are not changed
+            _traces = baselineIterator(_traces, self.auto_bs_lam, self.auto_bs_P)
+        
+        # the dialog only needs the name and the traces
+        _dataset = self.workingDataset.view(_traces)
         
         #get the times of the peaks from the "best" trace, that were selected auto or manually
-        _peak_t, _ = self.workingDataset.resultsDF.getPeaks('Mean', self.refSelection.currentText())  # pd.series
+        _peak_t, _ = self.workingDataset.resultsDF.getPeaks('Mean', self.refSelection.currentText())  # array
         
         #print ("srsv: {}".format(self.refSelection.currentText()))
         
-        _sorted_peak_t = _peak_t.sort_values(ascending=True)    # list is not sorted until now
-        _sorted_peak_t.dropna(inplace=True)                     # if there are 'empty' NaN, remove them
+        # list is not sorted until now, and if there are 'empty' NaN, remove them
+        _sorted_peak_t = np.sort(_peak_t[np.isfinite(_peak_t)])
         
         self.workingDataset.resultsDF.peakTimes = _sorted_peak_t # the definitive list of peak times, woud be degraded by editing but will only be used for masking traces later.
         
-        print ("swdrdfpt : {}".format(self.workingDataset.resultsDF.peakTimes))
+        logger.debug("swdrdfpt : %s", self.workingDataset.resultsDF.peakTimes)
         
         self.extPa["tPeaks"] = _sorted_peak_t
         
@@ -998,7 +1125,7 @@ class SAFTMainWindow(QMainWindow):
         if accepted:
             self.noPeaks = False
 
-            print (self.gpd.pk_extracted_by_condi) #will be the allow list if the allowlist
+            logger.debug("Extracted peaks: %s", self.gpd.pk_extracted_by_condi) #will be the allow list if the allowlist
             # these should now become available to be viewed (even edited?)
             
             #make 'save' and other analysis buttons available
@@ -1064,21 +1191,24 @@ class SAFTMainWindow(QMainWindow):
         """Do some setup immediately after data is loaded"""
         
         _sel_condi = self.p3Selection.currentText()
-        print ("Plot New Data with the p3 selector set for: ", _sel_condi)
+        logger.debug("Plot New Data with the p3 selector set for: %s", _sel_condi)
         y = {}
         
         self.p1.clear()
+        self.p1Items = {}
         self.p3.clear()
         
         for i, _condi in enumerate(self.conditions):
-            x = self.workingDataset.traces[_condi].index
-            y[i] = self.workingDataset.traces[_condi].mean(axis=1).to_numpy()
+            x = self.workingDataset.getTimes(_condi)
+            y[i] = self.workingDataset.getReduction(_condi, "Mean")
 
-            self.p1.plot(x, y[i], pen=(i,3))
+            _curve, _, _ = self.traceItems(i)
+            _curve.setData(x, y[i])
         
             if _sel_condi == _condi:
                 # curve
-                self.p3.plot(x, y[i], pen=(i,3))
+                self.p3.plot(x, y[i], pen=self.pens[i])
+                self.setP3Curve(x, y[i])
                 
                 if self.autoPeaks:
                     xp, yp = self.peaksWrapper(x, y[i], _condi)
@@ -1090,7 +1220,7 @@ class SAFTMainWindow(QMainWindow):
                     yp = np.array([])
                 
                 # need to add something to p3 scatter
-                self.p3.plot(xp, yp, name="Peaks "+_condi, pen=None, symbol="s", symbolBrush=(i,3))
+                self.p3.plot(xp, yp, name="Peaks "+_condi, pen=None, symbol="s", symbolBrush=self.brushes[i])
                 self.plots.peakslabel.setText("{} peaks in {} condition".format(len(yp), _condi))
                 
                 # create the object for parsing clicks in p3
@@ -1104,77 +1234,72 @@ class SAFTMainWindow(QMainWindow):
         #return
         
     def findSimplePeaks(self, xdat, ydat, name='unnamed'):
-        """Simple and dumb peak finding algorithm"""
+        """Simple and fast peak finding algorithm"""
         # cut_off is not implemented here
-        # SNR is used as a proxy for 'prominence' in the simple algorithm.
-        self.cwt_SNR = self.cwt_SNR_Spin.value()
-        
-        peaks, _ = scsig.find_peaks(ydat, prominence=self.cwt_SNR)
+        # SNR is used as a proxy for 'prominence' in the simple algorithm,
+        # and the width as the minimum spacing between peaks (in samples).
+        # parameters are read from the GUI by setPeakParams
+        peaks, _ = scsig.find_peaks(ydat, prominence=self.cwt_SNR, distance=self.cwt_width)
         _npeaks = len(peaks)
         if _npeaks != 0:
-            print ('Simple peak finding algorithm found {0} peaks in {1} trace with prominence {2}'.format(_npeaks, name, self.cwt_SNR))
-            
-            xp = xdat[peakcwt]
-            yp = ydat[peakcwt]
-            
+            logger.debug('Simple peak finding algorithm found %s peaks in %s trace with prominence %s', _npeaks, name, self.cwt_SNR)
         else:
-            print ('No peaks found in {0} trace with simple algorithm with prominence {1}'.format(name, self.cwt_SNR))
-            
-            xp = []
-            yp = []
+            logger.debug('No peaks found in %s trace with simple algorithm with prominence %s', name, self.cwt_SNR)
            
-        return xp, yp
+        return peaks
         
         
-    def findcwtPeaks(self, xdat, ydat, name='unnamed'):
-        """Find peaks using continuous wavelet transform"""
+    def findcwtPeaks(self, ydat, name='unnamed'):
+        """Find peaks using continuous wavelet transform
+        ydat can be 2-D (samples x traces), then the transform is done for all the traces at once
+        and a list of peak indices is returned"""
         # indices in peakcwt are not zero-biased
-        self.cwt_width = self.cwt_w_Spin.value()
-        self.cwt_SNR = self.cwt_SNR_Spin.value()
-        peakcwt = scsig.find_peaks_cwt(ydat, np.arange(1, self.cwt_width), min_snr=self.cwt_SNR) - 1
-        _npeaks = len(peakcwt)
-        if _npeaks != 0:
-            xpeak = xdat[peakcwt]
-            ypeak = ydat[peakcwt]
-            
-            # filter out small peaks
-            _cutOff = float (self.removeSml_Spin.value()) * ydat.max() / 100.0
-            xpf = xpeak[np.where(ypeak > _cutOff)]
-            ypf = ypeak[np.where(ypeak > _cutOff)]
-            
-            print ('wavelet transform peak finding algorithm found {0} peaks in {1} trace, width: {2}, SNR: {3}, cutOff: {4}.'.format(_npeaks, name, self.cwt_width, self.cwt_SNR, _cutOff))
-        else:
-            print ('No peaks found in {0} with cwt algorithm, width: {1}, SNR: {2}, cutOff: {4}.'.format(name, self.cwt_width, self.cwt_SNR, _cutOff))
-            xpf = []
-            ypf = []
-        #_condi = self.p3Selection.currentText() == _condi:
-        #self.plots.peakslabel.setText("{} peaks in ".format(_npeaks, _condi))
+        # parameters are read from the GUI by setPeakParams
+        # the cost of find_peaks_cwt is linear in the number of widths, so use at most the widest five
+        _widths = np.arange(max(1, self.cwt_width - 5), self.cwt_width)
+        peakcwt = find_peaks_cwt(ydat, _widths, min_snr=self.cwt_SNR)
+        if np.ndim(ydat) == 1:
+            peakcwt = [peakcwt]
+        peakcwt = [np.maximum(p - 1, 0) for p in peakcwt]
+        
+        for _p in peakcwt:
+            if len(_p) != 0:
+                logger.debug('wavelet transform peak finding algorithm found %s peaks in %s trace, width: %s, SNR: %s.', len(_p), name, self.cwt_width, self.cwt_SNR)
+            else:
+                logger.debug('No peaks found in %s with cwt algorithm, width: %s, SNR: %s.', name, self.cwt_width, self.cwt_SNR)
         
-        return xpf, ypf
+        # the small peak cutoff is applied by peaksBatch
+        return peakcwt[0] if np.ndim(ydat) == 1 else peakcwt
+    
+    def findProminentPeaks(self, xdat, ydat, name='unnamed'):
+        """Find peaks that stand out by SNR x the trace SD and are no wider than the width
+        Much faster than the wavelet transform and similar for fluorescence transients"""
+        # parameters are read from the GUI by setPeakParams
+        peaks, _ = scsig.find_peaks(ydat, prominence=self.cwt_SNR * np.std(ydat), width=(1, self.cwt_width))
+        logger.debug('SNR & width peak finding found %s peaks in %s trace, width: %s, SNR: %s.', len(peaks), name, self.cwt_width, self.cwt_SNR)
+        
+        # the small peak cutoff is applied by peaksBatch
+        return peaks
     
     def manualUpdate(self):
         """Some editing was done in p3, so update other windows accordingly"""
-        print ('Peak data in p3 changed manually')
+        logger.debug('Peak data in p3 changed manually')
        
         _sel_condi = self.p3Selection.currentText()
         _ROI = self.ROI_selectBox.currentText()
         
         # update the peaks in p1 and histograms only
-        utils.removeAllScatter(self.p1, verbose=False)
         
         #update p2 histograms
         self.updateHistograms()
         
         for i, _condi in enumerate(self.conditions):
-            #colours
-            col_series = (i, len(self.conditions))
-            
             if _sel_condi == _condi :
                 _scatter = utils.findScatter(self.p3.items)
                 # sometimes a new scatter is made and this "deletes" the old one
                 # retrieve the current manually curated peak data
                 if _scatter is None:
-                    print ('No Scatter found, empty data.')
+                    logger.debug('No Scatter found, empty data.')
                     xp = []
                     yp = []
                 else:
@@ -1186,37 +1311,127 @@ class SAFTMainWindow(QMainWindow):
              
             xp, yp = self.workingDataset.resultsDF.getPeaks(_ROI, _condi)
             
-            if self.split_traces:
-                _target = self.p1stackMembers[i]
-                # only one scatter item in each split view
-                _t_scat = utils.findScatter(_target.items)
-                _t_scat.setData(xp, yp, brush=col_series)
-                
-            else:
-                self.p1.plot(xp, yp, pen=None, symbol="s", symbolBrush=col_series)
+            # one peak scatter for each condition in p1 (or the split view), replace its data
+            _, _scatter, _ = self.traceItems(i)
+            _scatter.setData(xp, yp)
             
             self.plots.peakslabel.setText("{} peaks in {} condition.".format(len(yp), _condi))
                 
+    def traceItems(self, i):
+        """Curve, peak scatter and baseline items for condition i in p1 or its split plot
+        They are made once and afterwards only get new data with setData"""
+        
+        if self.split_traces:
+            _items = self.p1stackItems
+            _target = self.p1stackMembers[i]
+        else:
+            _items = self.p1Items
+            _target = self.p1
+        
+        if i not in _items:
+            _curve = _target.plot(pen=self.pens[i])
+            _scatter = _target.plot(pen=None, symbol="s", symbolBrush=self.brushes[i])
+            _baseline = _target.plot(pen=(255,255,255,80))
+            _items[i] = (_curve, _scatter, _baseline)
+        
+        return _items[i]
+    
+    def setColours (self):
+        """Make a pen and brush for each condition, rather than one for every plot call"""
+        
+        _n = len(self.conditions)
+        self.pens = [pg.mkPen((i, _n)) for i in range(_n)]
+        self.brushes = [pg.mkBrush((i, _n)) for i in range(_n)]
+    
     def setBaselineParams (self):
         """Get parameters for auto baseline from GUI"""
         
         self.auto_bs_lam =  10 ** self.auto_bs_lam_slider.value()
         self.auto_bs_P =  10 ** (- self.auto_bs_P_slider.value() / 5)
     
+    def setPeakParams (self):
+        """Get parameters for peak finding from GUI"""
+        # read once per update rather than for every trace
+        
+        self.cwt_width = self.cwt_w_Spin.value()
+        self.cwt_SNR = self.cwt_SNR_Spin.value()
+        self.removeSml = self.removeSml_Spin.value()
+    
     def peaksWrapper (self, x , y, set):
         """Simplify peak finding calls"""
-        
-        if self.simplePeaks:
-            xp, yp = self.findSimplePeaks(x , y, name=set)
+        return self.peaksBatch([x], [y], [set])[0]
+    
+    def peaksBatch (self, xs, ys, names, values=None):
+        """Peaks (times and values) for several traces at once, e.g. one ROI in all conditions
+        Wavelet transforms of traces with the same length are done together on the stacked traces
+        The peak values are taken from values (e.g. the double precision traces) if given, otherwise from ys"""
+        
+        # the same trace with the same settings gives the same peaks, so reuse them
+        # the small peak cutoff is applied afterwards, so changing it does not mean a new search
+        _keys = []
+        for x, y in zip(xs, ys):
+            _h = hashlib.blake2b(digest_size=8)
+            _h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+            _h.update(np.ascontiguousarray(y, dtype=float).tobytes())
+            _keys.append((_h.digest(), self.simplePeaks, self.cwtRidges, self.cwt_width, self.cwt_SNR))
+        
+        _idx = [None] * len(ys)
+        _todo = []
+        for i, _key in enumerate(_keys):
+            if _key in self.peakCache:
+                self.peakCache.move_to_end(_key)
+                _idx[i] = self.peakCache[_key]
+                logger.debug('Reusing %s peaks found before in %s trace', len(_idx[i]), names[i])
+            else:
+                _todo.append(i)
+        
+        if self.cwtRidges:
+            # one transform for each group of traces with the same length
+            for _group in self.sameLengthGroups(ys, _todo):
+                _stack = np.column_stack([ys[i] for i in _group])
+                for i, _p in zip(_group, self.findcwtPeaks(_stack, name=", ".join(names[i] for i in _group))):
+                    _idx[i] = _p
         else:
-            xp, yp = self.findcwtPeaks(x , y, name=set)
+            for i in _todo:
+                if self.simplePeaks:
+                    _idx[i] = self.findSimplePeaks(xs[i], ys[i], name=names[i])
+                else:
+                    _idx[i] = self.findProminentPeaks(xs[i], ys[i], name=names[i])
+        
+        for i in _todo:
+            self.peakCache[_keys[i]] = _idx[i]
+            if len(self.peakCache) > self.peakCacheSize:
+                # forget the least recently used
+                self.peakCache.popitem(last=False)
+        
+        if not self.simplePeaks:
+            # filter out small peaks (below a percentage of the trace maximum), for all traces of a length at once
+            for _group in self.sameLengthGroups(ys, range(len(ys))):
+                _stack = np.column_stack([ys[i] for i in _group])
+                _kept = removeSmallPeaks(_stack, [_idx[i] for i in _group], float(self.removeSml))
+                for i, _k in zip(_group, _kept):
+                    _idx[i] = _k
+            logger.debug('Kept peaks above %s%% of max.', self.removeSml)
+        
+        if values is None:
+            values = ys
+        return [(x[i], v[i]) for x, v, i in zip(xs, values, _idx)]
     
-        return xp, yp
+    def sameLengthGroups (self, ys, indices):
+        """Lists of the indices (from those given) of traces in ys that have the same length"""
+        _groups = {}
+        for i in indices:
+            _groups.setdefault(len(ys[i]), []).append(i)
+        return list(_groups.values())
         
     def updateROI_list_Box(self):
         """populate the combobox for choosing which ROI to show"""
+        # without blocking, clearing and adding items each trigger a full update
+        # callers run ROI_Change once afterwards
+        self.ROI_selectBox.blockSignals(True)
         self.ROI_selectBox.clear()
         self.ROI_selectBox.addItems(self.workingDataset.ROI_list)
+        self.ROI_selectBox.blockSignals(False)
     
     def ROI_Change(self):
         """General 'Update' method"""
@@ -1236,10 +1451,12 @@ class SAFTMainWindow(QMainWindow):
         # something changed in the control panel, get latest values
         _ROI = self.ROI_selectBox.currentText()
               
-        if self.peak_CB.value() == 'simple':
-            self.simplePeaks = True
-        else:
-            self.simplePeaks = False
+        _method = self.peak_CB.value()
+        self.simplePeaks = _method == 'simple'
+        self.cwtRidges = _method == 'wavelet'
+        
+        if self.autoPeaks:
+            self.setPeakParams()
 
         if self.autobs_Box.value() != 'None':
             self.auto_bs = True
@@ -1260,51 +1477,80 @@ class SAFTMainWindow(QMainWindow):
         y = {}
         z = {}
         
-        # Rather than doing this, need to keep the peak objects and set their data anew?
-        self.p1.clear()
+        # the items in p1 are kept and set with new data below (traceItems)
         
         # Rather than clearing objects in p3, we set their data anew
         _p3_items = self.p3.items
         _p3_scatter = utils.findScatter(_p3_items)
         _p3_curve = utils.findCurve(_p3_items)
         
+        xs = {}
         for i, _condi in enumerate(self.conditions):
-            col_series = (i, len(self.conditions))
-            x = np.array(self.workingDataset.traces[_condi].index)
+            x = self.workingDataset.getTimes(_condi)
+            xs[i] = x
             
             if _ROI == "Mean":
-                y[i] = self.workingDataset.traces[_condi].mean(axis=1).to_numpy()
+                y[i] = self.workingDataset.getReduction(_condi, "Mean")
                 
             elif _ROI == "Variance":
-                y[i] = self.workingDataset.traces[_condi].var(axis=1).to_numpy()
+                y[i] = self.workingDataset.getReduction(_condi, "Variance")
                 # we never want to subtract the steady state variance
                 self.auto_bs = False
-                print ('No baseline subtraction for variance trace')
+                logger.debug('No baseline subtraction for variance trace')
                 
             elif _ROI != '':
-                print ("condi, roi {} {}".format(_condi, _ROI))
-                y[i] = self.workingDataset.traces[_condi][_ROI].to_numpy()
+                logger.debug("condi, roi %s %s", _condi, _ROI)
+                y[i] = self.workingDataset.getTrace(_condi, _ROI)
             
             else:
                 return
             
+            # the baselined and smoothed traces of the ROI on show are kept, so a change
+            # to a later stage (smoothing, peak finding) does not redo the earlier ones
+            _stage = self.stageCache.get(_condi)
+            if _stage is None or _stage['ROI'] != _ROI:
+                _stage = {'ROI': _ROI}
+                self.stageCache[_condi] = _stage
+            
+            _bsKey = None
             if self.auto_bs:
-                # baseline
-                z[i] = baseline_als(y[i], lam=self.auto_bs_lam, p=self.auto_bs_P, niter=10)
-                
-                # subtract the baseline
-                y[i] = y[i] - z[i]
+                _bsKey = (self.auto_bs_lam, self.auto_bs_P)
+                if _stage.get('bsKey') != _bsKey:
+                    # baseline
+                    _z = baseline_als(y[i], lam=self.auto_bs_lam, p=self.auto_bs_P, niter=10, quiet=True)
+                    logger.debug('Asymmetric Baseline subtraction with lambda %.3f and p %.3f.', self.auto_bs_lam, self.auto_bs_P)
+                    
+                    # traces from the dataset are views or read only, so subtracting makes the copy
+                    y[i] = y[i] - _z
+                    
+                    _stage['bs'] = (y[i], _z)
+                    _stage['bsKey'] = _bsKey
                 
                 # plotting is done below
+                y[i], z[i] = _stage['bs']
                 
             if self.sgSmooth:
-                print ('Savitsky Golay smoothing with window: {0}'.format(self.sgWin))
-                y[i] = savitzky_golay(y[i], window_size=self.sgWin, order=4)
-
+                _sgKey = (_bsKey, self.sgWin)
+                if _stage.get('sgKey') != _sgKey:
+                    logger.debug('Savitsky Golay smoothing with window: %s', self.sgWin)
+                    _stage['sg'] = savitzky_golay(y[i], window_size=self.sgWin, order=4)
+                    _stage['sgKey'] = _sgKey
+                y[i] = _stage['sg']
+        
+        if self.autoPeaks:
+            # call the relevant peak finding algorithm for the traces of all conditions together
+            _n = len(self.conditions)
+            # peaks of an unprocessed (single precision) trace get their values from the double precision data
+            _values = [self.workingDataset.traces[_condi][_ROI].to_numpy(dtype=float) if y[i].dtype == np.float32 else y[i]
+                        for i, _condi in enumerate(self.conditions)]
+            _found = self.peaksBatch([xs[i] for i in range(_n)], [y[i] for i in range(_n)], self.conditions, _values)
+        
+        for i, _condi in enumerate(self.conditions):
+            x = xs[i]
+            
             if self.autoPeaks:
                 
-                # call the relevant peak finding algorithm
-                xp, yp = self.peaksWrapper(x, y[i], _condi)
+                xp, yp = _found[i]
                 self.plots.peakslabel.setText("{} peaks in {} condition".format(len(yp), _condi))
                 
                 # write automatically found peaks into results
@@ -1315,27 +1561,24 @@ class SAFTMainWindow(QMainWindow):
                 
                 # read back existing peak data from results (might be empty if it's new ROI)
                 xp, yp = self.workingDataset.resultsDF.getPeaks(_ROI, _condi)
-                if len(yp) == 0: print ("Peak results for {} {} are empty".format( _ROI, _condi))
+                if len(yp) == 0: logger.debug("Peak results for %s %s are empty", _ROI, _condi)
                 else :
                     try:
-                        print ("Retrieved: {} {} first xp,yp : {}, {}".format( _ROI, _condi, xp[0], yp[0]))
-                    except KeyError:
+                        logger.debug("Retrieved: %s %s first xp,yp : %s, %s", _ROI, _condi, xp[0], yp[0])
+                    except IndexError:
                         #print (xp.shape, yp.shape)
-                        print ("No peaks, xp or yp empty? {} {} {} {}".format(_ROI, _condi, xp, yp))
+                        logger.debug("No peaks, xp or yp empty? %s %s %s %s", _ROI, _condi, xp, yp)
                         
             # draw p1 traces and scatter
-            if self.split_traces:
-                target = self.p1stackMembers[i]
-                target.clear()
-                target.plot(x, y[i], pen=col_series)
-                if len(yp) > 0 : target.plot(xp, yp, pen=None, symbol="s", symbolBrush=col_series)
+            _curve, _scatter, _baseline = self.traceItems(i)
+            _curve.setData(x, y[i])
+            _scatter.setData(xp, yp)
+            
+            #plot baseline, offset by the signal max (not in split traces).
+            if self.auto_bs and not self.split_traces:
+                _baseline.setData(x, z[i]-y[i].max())
             else:
-                self.p1.plot(x, y[i], pen=col_series)
-                if len(yp) > 0 : self.p1.plot(xp, yp, pen=None, symbol="s", symbolBrush=col_series)
-                
-                #plot baseline, offset by the signal max.
-                if self.auto_bs:
-                    self.p1.plot(x, z[i]-y[i].max(), pen=(255,255,255,80))
+                _baseline.setData([], [])
             
             #p3: plot only the chosen trace
             if self.p3Selection.currentText() == _condi:
@@ -1343,13 +1586,14 @@ class SAFTMainWindow(QMainWindow):
                 if _p3_scatter is None:
                     # Do something about it, there is no peak scatter yet in this graph
                     if len(yp) > 0 :
-                        self.p3.plot(xp, yp, name="Peaks "+_condi, pen=None, symbol="s", symbolBrush=col_series)
+                        self.p3.plot(xp, yp, name="Peaks "+_condi, pen=None, symbol="s", symbolBrush=self.brushes[i])
                 else:
                     _p3_scatter.clear()
-                    if len(yp) > 0 : _p3_scatter.setData(xp, yp, brush=col_series)
+                    if len(yp) > 0 : _p3_scatter.setData(xp, yp, brush=self.brushes[i])
                 
                 _p3_curve.clear()
-                _p3_curve.setData(x, y[i], pen=col_series)
+                _p3_curve.setData(x, y[i], pen=self.pens[i])
+                self.setP3Curve(x, y[i])
                 
         self.createLinearRegion()
         
@@ -1360,24 +1604,13 @@ class SAFTMainWindow(QMainWindow):
     def setRanges(self):
         """ Collect the extremities of data over a set of conditions """
         self.ranges = {}
-        # use the first condition (sheet) as a basis
-        _df = self.workingDataset.traces[self.conditions[0]]
-        self.ranges['xmin'] = _df.index.min()
-        self.ranges['xmax'] = _df.index.max()
-        self.ranges['ymin'] = _df.min().min()
-        self.ranges['ymax'] = _df.max().max()
-        
-        # lazily compare across all conditions (including the first)
-        for sheet in self.workingDataset.traces.values():
-            if sheet.min().min() < self.ranges['ymin']:
-                self.ranges['ymin'] = sheet.min().min()
-            if sheet.max().max() > self.ranges['ymax']:
-                self.ranges['ymax'] = sheet.max().max()
-                
-            if sheet.index.min() < self.ranges['xmin']:
-                self.ranges['xmin'] = sheet.index.min()
-            if sheet.index.max() > self.ranges['xmax']:
-                self.ranges['xmax'] = sheet.index.max()
+        # one numpy reduction for each condition's (samples x ROIs) array, no pandas per column
+        _arrays = self.workingDataset.traceArrays.values()
+        _times = self.workingDataset.timeArrays.values()
+        self.ranges['xmin'] = min(np.nanmin(t) for t in _times)
+        self.ranges['xmax'] = max(np.nanmax(t) for t in _times)
+        self.ranges['ymin'] = min(np.nanmin(a) for a in _arrays)
+        self.ranges['ymax'] = max(np.nanmax(a) for a in _arrays)
         return
     
     def save_peaks(self):
@@ -1400,48 +1633,35 @@ class SAFTMainWindow(QMainWindow):
         
         if self.filename:
             _wds = self.workingDataset
-            wb = Workbook()
+            # rows are streamed to the file, the workbook starts without sheets
+            wb = utils.streamWorkbook(self.filename)
             
             # combine allowlist and excludelist dictionaries for output
-            #_output = {**self.gpd.pk_extracted_by_condi, **self.gpd.excludelisted_by_condi}
-            _allowedPeaks = {}
-            _excludedPeaks = {}
-            
-            if _wds.resultsDF:
-                _allowedPeaks = utils.decomposeRDF (_wds.resultsDF.df)
-            if _wds.excludelisted:
-                _excludedPeaks = utils.decomposeRDF (_wds.excludelisted.df)
-            
-            _output = {**_allowedPeaks, **_excludedPeaks}
+            # (excluded conditions are named with their SNR cut, so they get their own sheets)
+            # a dataset only has the results that were made for it
+            _output = {}
+            for _r in ("resultsDF", "excludelisted"):
+                _results = getattr(_wds, _r, None)
+                if _results is not None:
+                    _output.update(utils.decomposeRDF (_results.df))
             
             for _condi, _resultdf in _output.items():
                 # in case there are duplicate peaks extracted, remove them and package into dummy variable
-                # this syntax means : loc["not" the duplicates]
-                _pe = _resultdf.loc[~_resultdf.index.duplicated(keep='first')] #StackOverflow 13035764
+                # positional selection of the rows that are "not" the duplicates, only if there are any
+                _pe = _resultdf
+                if not _resultdf.index.is_unique:
+                    _pe = _resultdf.iloc[~_resultdf.index.duplicated(keep='first')] #StackOverflow 13035764
                 
-                wb.create_sheet(_condi)
-                _wcs = wb[_condi]
+                _wcs = wb.create_sheet(_condi)
                 
-                # write customised header
-                for _num, _pcol in enumerate(_pe.columns.values):
-                    _wcs.cell(1, _num + 1).value = _pcol + " " + _condi      #, header_format)
-                    
-                # write out data
-                for _row in dataframe_to_rows(_pe, index=False, header=False):
-                    _wcs.append(_row)
-            
-                #write index
-                _wcs.insert_cols(1)
-                for _num, _pin in enumerate(_pe.index.values):
-                    _wcs.cell(1,1).value = "Time"
-                    _wcs.cell(_num + 2, 1).value = _pin
-            
-            wb.remove(wb['Sheet'])
+                # customised header, then time index and peaks in each row
+                _header = ["Time"] + [_pcol + " " + _condi for _pcol in _pe.columns.values]
+                utils.appendSheetRows(_wcs, _header, _pe.index.values, _pe.values)
             
             if self.saveHistogramsOption:
                 wb = self.save_histograms(wb)
             
-            wb.save(self.filename)
+            wb.save()
             print ("Saved peaks from to workboook {}".format(self.filename))
           
             
@@ -1451,24 +1671,13 @@ class SAFTMainWindow(QMainWindow):
         
         print ("saving histograms")
         self.doHistograms()
-        print (self.hDF.df.head(5))
+        logger.debug("hDF head: %s", self.hDF.df.head(5))
         #save histograms into new sheet
-        wb.create_sheet("Histograms")
-        _wcs = wb["Histograms"]
-    
-        # write header
-        for col_num, col in enumerate(self.hDF.df.columns.values):
-            _wcs.cell(1, col_num + 1).value = str(col) + " hi"
-        
-        # histogrammed data
-        for _row in dataframe_to_rows(self.hDF.df, index=False, header=False):
-            _wcs.append(_row)
-        
-        # bin edges go in first column
-        _wcs.insert_cols(1)
-        for _num, _pin in enumerate(self.hDF.binEdges):
-            _wcs.cell(1,1).value = "BinEdges"
-            _wcs.cell(_num + 2, 1).value = _pin
+        _wcs = wb.create_sheet("Histograms")
+        
+        # bin edges go in first column, there is one more edge than rows of counts
+        _header = ["BinEdges"] + [str(col) + " hi" for col in self.hDF.df.columns.values]
+        utils.appendSheetRows(_wcs, _header, self.hDF.binEdges, self.hDF.df.values)
             
         return wb
         
@@ -1481,29 +1690,15 @@ class SAFTMainWindow(QMainWindow):
         
         if self.btfilename:
             _wdsT = self.workingDataset.traces
-            wb = Workbook()
+            wb = utils.streamWorkbook(self.btfilename)
             for _condi, _tdf in _wdsT.items():
-                wb.create_sheet(_condi)
-                _wcs = wb[_condi]
+                _wcs = wb.create_sheet(_condi)
                 
-                # write customised header
-                for _num, _pcol in enumerate(_tdf.columns.values):
-                    _wcs.cell(1, _num + 1).value = _pcol + " " + _condi      #, header_format)
-                    
-                # write out data
-                for _row in dataframe_to_rows(_tdf, index=False, header=False):
-                    _wcs.append(_row)
+                # customised header, then time index and trace values in each row
+                _header = ["Time"] + [_pcol + " " + _condi for _pcol in _tdf.columns.values]
+                utils.appendSheetRows(_wcs, _header, _tdf.index.values, _tdf.values)
             
-                #write index
-                _wcs.insert_cols(1)
-                for _num, _pin in enumerate(_tdf.index.values):
-                    _wcs.cell(1,1).value = "Time"
-                    _wcs.cell(_num + 2, 1).value = _pin
-            
-            # was created at start
-            
-            wb.remove(wb['Sheet'])
-            wb.save(self.btfilename)
+            wb.save()
             print ("Saved traces from to workboook {}".format(self.btfilename))
             
     def open_file(self):
@@ -1530,14 +1725,16 @@ class SAFTMainWindow(QMainWindow):
             """
             
             # Now as a oneliner
-            #"None" reads all the sheets into a dictionary of data frames
-            _traces = pd.read_excel(self.filename, None, index_col=0)
+            # all the sheets are read into a dictionary of data frames
+            # (from the parquet sidecar if the workbook was opened before)
+            _traces = utils.readTraceWorkbook(self.filename)
         
         else:
             print ("file dialog failed")
             return
         
         self.conditions = list(_traces.keys())
+        self.setColours()
         
         print ("Loaded following conditions: ", self.conditions)
         
@@ -1545,12 +1742,14 @@ class SAFTMainWindow(QMainWindow):
             print ("First data set loaded")
         
         else:
-            #store existing working dataset
-            self.store.storeSet(copy.copy(self.workingDataset))
+            #store existing working dataset and start a fresh one for the new traces
+            self.store.storeSet(self.workingDataset)
             print ("Putting {} in the store.".format(self.workingDataset.DSname))
+            self.workingDataset = Dataset()
         
         # overwrite current working set
         self.workingDataset.addTracesToDS(_traces)
+        self.stageCache = {}
         self.workingDataset.isEmpty = False
         _stem = utils.getFileStem(self.filename)
         self.workingDataset.setDSname(_stem)
@@ -1585,6 +1784,9 @@ class SAFTMainWindow(QMainWindow):
         
         # populate the comboboxes for choosing the data shown in the zoom view,
         # and choosing the reference ROI for peak extraction
+        # signals are blocked because the update is done once below
+        self.p3Selection.blockSignals(True)
+        self.refSelection.blockSignals(True)
         self.p3Selection.clear()
         self.p3Selection.addItems(self.conditions)
         self.refSelection.clear()
@@ -1595,9 +1797,12 @@ class SAFTMainWindow(QMainWindow):
             self.refSelection.setCurrentIndex(i)      # the default
             self.p3Selection.setCurrentIndex(i)     #set both for now
         
+        self.p3Selection.blockSignals(False)
+        self.refSelection.blockSignals(False)
+        
         #create a dataframe for peak measurements
         self.workingDataset.resultsDF = Results(self.workingDataset.ROI_list, self.conditions)
-        print ("peakResults object created", self.workingDataset.resultsDF, self.workingDataset.ROI_list)
+        logger.debug("peakResults object created %s %s", self.workingDataset.resultsDF, self.workingDataset.ROI_list)
         
         self.plotNewData()
         
@@ -1624,8 +1829,9 @@ if __name__ == "__main__":
             print ("Failed to import NSBundle, couldn't change menubar name." )
             
     
-    __version__ = "v. 0.4"
     #print (sys.version)
+    # set the level to logging.DEBUG to follow each update in the terminal
+    logging.basicConfig(level=logging.WARNING, format="%(name)s %(levelname)s: %(message)s")
     app = QApplication([])
     smw = SAFTMainWindow()
     smw.show()
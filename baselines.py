@@ -1,8 +1,14 @@
+from functools import lru_cache
+from math import factorial
+
 import numpy as np
 from scipy import sparse
-from scipy.sparse.linalg import spsolve
+from scipy.linalg import solveh_banded
 import pyqtgraph as pg
 
+# numba's prange once alsKernel has compiled the loops
+prange = range
+
 def savitzky_golay(y, window_size, order, deriv=0, rate=1):
     """From SciPy cookbook
 https://scipy-cookbook.readthedocs.io/items/SavitzkyGolay.html
@@ -57,7 +63,6 @@ References
    Cambridge University Press ISBN-13: 9780521880688
     """
     #import numpy as np
-    from math import factorial
 
     try:
         window_size = np.abs(np.int(window_size))
@@ -69,21 +74,118 @@ References
         raise TypeError("window_size size must be a positive odd number")
     if window_size < order + 2:
         raise TypeError("window_size is too small for the polynomials order")
-    order_range = range(order+1)
     half_window = (window_size -1) // 2
-    # precompute coefficients
-    b = np.mat([[k**i for i in order_range] for k in range(-half_window, half_window+1)])
-    m = np.linalg.pinv(b).A[deriv] * rate**deriv * factorial(deriv)
+    # coefficients only depend on the filter settings, so they are cached
+    m = savitzky_golay_kernel(window_size, order, deriv, rate)
     # pad the signal at the extremes with
     # values taken from the signal itself
     firstvals = y[0] - np.abs( y[1:half_window+1][::-1] - y[0] )
     lastvals = y[-1] + np.abs(y[-half_window-1:-1][::-1] - y[-1])
     y = np.concatenate((firstvals, y, lastvals))
-    return np.convolve( m[::-1], y, mode='valid')
+    return np.convolve(m, y, mode='valid')
+
+@lru_cache(maxsize=16)
+def savitzky_golay_kernel(window_size, order, deriv=0, rate=1):
+    """Convolution kernel (reversed coefficients) for savitzky_golay
+    The pseudoinverse is only computed once for each set of filter settings"""
+    
+    order_range = range(order+1)
+    half_window = (window_size -1) // 2
+    b = np.array([[k**i for i in order_range] for k in range(-half_window, half_window+1)])
+    m = np.linalg.pinv(b)[deriv] * rate**deriv * factorial(deriv)
+    kernel = m[::-1].copy()
+    # the cached copy is shared between calls
+    kernel.setflags(write=False)
+    return kernel
+
+@lru_cache(maxsize=8)
+def smoothnessBand(L):
+    """D.D' for the second difference matrix D, in upper banded form for solveh_banded
+    D.D' is pentadiagonal and only depends on the trace length L, so it is cached"""
+    
+    D = sparse.diags([1, -2, 1],[0, -1, -2], shape=(L, L-2))
+    DDT = D.dot(D.transpose())
+    ab = np.zeros((3, L))
+    ab[0, 2:] = DDT.diagonal(2)
+    ab[1, 1:] = DDT.diagonal(1)
+    ab[2] = DDT.diagonal(0)
+    # the cached copy is shared between calls
+    ab.setflags(write=False)
+    return ab
+    
+def alsBanded(y, lam, p, niter, band):
+    """All the ALS iterations for each column of y (samples x traces)
+    (W + lam * D.D') is pentadiagonal, so each solve is a banded LDL' factorisation
+    band is the upper band of D.D' from smoothnessBand
+    The traces are independent, so with numba they are shared between threads"""
     
+    T, n = y.shape
+    z = np.empty((T, n))
+    for j in prange(n):
+        # work arrays for each trace (and thread)
+        w = np.ones(T)
+        d = np.empty(T)
+        l1 = np.zeros(T + 1)     # L[i, i-1]
+        l2 = np.zeros(T + 2)     # L[i, i-2]
+        u = np.empty(T)
+        for it in range(niter):
+            # factorise
+            for i in range(T):
+                d[i] = lam * band[2, i] + w[i]
+                if i > 0:
+                    d[i] -= l1[i] * l1[i] * d[i-1]
+                if i > 1:
+                    d[i] -= l2[i] * l2[i] * d[i-2]
+                if i + 2 < T:
+                    l2[i+2] = lam * band[0, i+2] / d[i]
+                if i + 1 < T:
+                    _e = lam * band[1, i+1]
+                    if i > 0:
+                        _e -= l2[i+1] * l1[i] * d[i-1]
+                    l1[i+1] = _e / d[i]
+            # forward substitution
+            for i in range(T):
+                u[i] = w[i] * y[i, j]
+                if i > 0:
+                    u[i] -= l1[i] * u[i-1]
+                if i > 1:
+                    u[i] -= l2[i] * u[i-2]
+            # back substitution
+            for i in range(T - 1, -1, -1):
+                _z = u[i] / d[i]
+                if i + 1 < T:
+                    _z -= l1[i+1] * z[i+1, j]
+                if i + 2 < T:
+                    _z -= l2[i+2] * z[i+2, j]
+                z[i, j] = _z
+            # new weights
+            for i in range(T):
+                if y[i, j] > z[i, j]:
+                    w[i] = p
+                elif y[i, j] < z[i, j]:
+                    w[i] = 1 - p
+                else:
+                    w[i] = 0.
+    return z
+
+@lru_cache(maxsize=1)
+def alsKernel():
+    """alsBanded compiled by numba (or loaded from its cache), parallel over traces, or None without numba
+    numba is only imported for the first baseline, not at startup"""
+    
+    global prange
+    try:
+        import numba
+    except ImportError:
+        print ("numba not found, using scipy for baseline subtraction.")
+        return None
+    prange = numba.prange
+    return numba.njit(parallel=True, cache=True)(alsBanded)
+
 def baseline_als(y, lam, p, niter=20, quiet=False):
     
     """ y is a numpy array, niter is the number of iterations
+    y can also be 2-D (samples x traces), then each column gets its own baseline
     
     from https://stackoverflow.com/questions/29156532
     Reference: "Asymmetric Least Squares Smoothing" by P. Eilers and H. Boelens in 2005.
@@ -92,14 +194,33 @@ def baseline_als(y, lam, p, niter=20, quiet=False):
     should vary λ on a grid that is approximately linear for log λ"""
     
     if not quiet: print('Asymmetric Baseline subtraction with lambda {0:.3f} and p {1:.3f}.'.format(lam, p))
-    L = len(y)
-    D = sparse.diags([1, -2, 1],[0, -1, -2], shape=(L, L-2))
-    w = np.ones(L)
+    y = np.asarray(y, dtype=float)
+    L = y.shape[0]
+    band = smoothnessBand(L)
+    
+    _kernel = alsKernel()
+    if _kernel is not None:
+        if y.ndim == 2:
+            return _kernel(y, lam, p, niter, band)
+        return _kernel(y[:, None], lam, p, niter, band)[:, 0]
+    
+    if y.ndim == 2:
+        # put the columns end to end. The band of each block has zeros where it would
+        # couple to its neighbours, so one banded solve does all the traces at once
+        n = y.shape[1]
+        band = np.tile(band, n)
+        y = y.T.ravel()
+    
+    w = np.ones(y.size)
     for i in range(niter):
-        WW = sparse.spdiags(w, 0, L, L)
-        ZZ = WW + lam * D.dot(D.transpose())
-        z = spsolve(ZZ, w * y)
+        # (W + lam * D.D') is symmetric positive definite and banded
+        ZZ = lam * band
+        ZZ[2] += w
+        z = solveh_banded(ZZ, w * y, overwrite_ab=True)
         w = p * (y > z) + (1-p) * (y < z)
+    
+    if y.size != L:
+        return z.reshape(n, L).T
     return z
 
 def baselineIterator(data, lam, p, niter=20):
@@ -107,18 +228,25 @@ def baselineIterator(data, lam, p, niter=20):
     
     #is there a problem with running it twice? No, the problem was peaks were being chucked out
     
+    # new dataframes are returned, the traces passed in are not modified
     bdata = {}
-    for _set, df in data.items():
-        print ("Auto baseline for {0} set. lambda: {1:.3f} and p: {2:.3f}".format(_set, lam, p))
-        
-        maxVal = len (df.columns)
-        progMsg = "Auto baseline for {0} traces".format(maxVal)
-        with pg.ProgressDialog(progMsg, 0, maxVal) as dlg:
-            dlg.setMinimumWidth(300)
-            for col in df:
-                dlg += 1
-                y = np.asarray(df[col])
-                # subtract appropriate baseline from each column of df
-                df[col] -= baseline_als(y, lam, p, niter=20, quiet=True)
-        bdata[_set] = df
+    maxVal = len (data)
+    progMsg = "Auto baseline for {0} sets of traces".format(maxVal)
+    with pg.ProgressDialog(progMsg, 0, maxVal) as dlg:
+        dlg.setMinimumWidth(300)
+        for _set, df in data.items():
+            dlg += 1
+            print ("Auto baseline for {0} set. lambda: {1:.3f} and p: {2:.3f}".format(_set, lam, p))
+            
+            y = df.to_numpy(dtype=float)
+            
+            # all the complete traces are done in one batch
+            # traces with gaps (NaN) would spoil the batch, their baseline is NaN as before
+            z = np.full_like(y, np.nan)
+            finite = np.isfinite(y).all(axis=0)
+            if finite.any():
+                z[:, finite] = baseline_als(y[:, finite], lam, p, niter=niter, quiet=True)
+            
+            # subtract appropriate baseline from each column of df
+            bdata[_set] = df - z
     return bdata
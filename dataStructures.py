@@ -1,8 +1,11 @@
 import itertools
+import logging
 import pandas as pd
 import numpy as np
 from utils import maskPeaks
 
+logger = logging.getLogger("SAFT")
+
 def histogramFitParams(conditions, pColumns=None):
     if pColumns == None:
         
@@ -70,14 +73,15 @@ class HistogramsR():
         self.ROI_list = ROI_list
         self.set_list = set_list
         
-        _, self.binEdges = np.histogram([0], bins = Nbins, range = (binStart, binEnd))
+        # regular bins, the same edges np.histogram would return
+        self.binEdges = np.linspace(binStart, binEnd, Nbins + 1)
         self.headr = list(itertools.product(self.ROI_list, self.set_list))
         #print (self.ROI_list, self.set_list, self.extracted, self.headr)
-        print (self.binEdges)
+        logger.debug("Histogram bin edges: %s", self.binEdges)
         self.cols = pd.MultiIndex.from_tuples(self.headr)
         
         self.df = pd.DataFrame([], range(Nbins), self.cols)
-        print (self.df.head())
+        logger.debug("Histogram table: %s", self.df.head())
         
     def ROI_sum (self):
         
@@ -88,13 +92,19 @@ class HistogramsR():
         # the histogram are arrays of values that belong to a ROI and a set (condition) or a sum for the ROI.
         #_h = np.append(_h, [np.nan])       #to equalize lengths
         
-        print (_ROI, _condition, _h)
-        print (len(self.df.index), len(_h))
+        logger.debug("addHist %s %s, %s bins for %s rows", _ROI, _condition, len(_h), len(self.df.index))
         # overwrite or add column if new
         self.df[_ROI, _condition] = pd.Series(_h)
-        print (self.df[_ROI][_condition])
         
 
+    def setHists (self, _pairs, _h):
+        # histograms for a list of (ROI, condition) pairs, _h is an array of bins x pairs
+        # all the columns are written in one assignment
+        
+        _cols = pd.MultiIndex.from_tuples(_pairs)
+        self.df[_cols] = pd.DataFrame(_h, index=self.df.index, columns=_cols)
+        logger.debug("Added %s histograms", len(_cols))
+    
     def getHist (self, _ROI, _condition):
         
         _hx = self.binEdges
@@ -113,13 +123,40 @@ class Results:
         self.ROI_list = ROI_list
         self.condition_list = condition_list
         self.pairs = ['t', 'peak']
-        
+        self.table = None
+        # peaks from addPeaks are kept as arrays, (ROI, condition) : (times, peaks)
+        # and only written into the table when it is needed
+        self.peakArrays = {}
         
         #print (self.ROI_list, self.condition_list, self.pairs, self.headr)
         #print (type(self.ROI_list), type(self.condition_list), type(self.pairs), type(self.headr))
         if self.ROI_list and self.condition_list:
             self.makeDF()
     
+    @property
+    def df(self):
+        if self.peakArrays:
+            self.writePeakArrays()
+        return self.table
+    
+    @df.setter
+    def df(self, _df):
+        # a new table replaces any peaks that were waiting
+        self.table = _df
+        self.peakArrays = {}
+    
+    def writePeakArrays(self):
+        # put the peaks from addPeaks into the table, all at once
+        _longest = max(len(_p) for _t, _p in self.peakArrays.values())
+        if self.table.index.size < _longest:
+            self.table = self.table.reindex(range(_longest))
+        
+        for (_ROI, _condition), (_times, _peaks) in self.peakArrays.items():
+            # overwrite or add column if new
+            self.table[_ROI, _condition, 't'] = pd.Series(_times)
+            self.table[_ROI, _condition, 'peak'] = pd.Series(_peaks)
+        self.peakArrays = {}
+    
     def makeDF(self, _index=[0]):
         self.makeCols()
         self.df = pd.DataFrame([], _index, self.cols)
@@ -178,25 +215,21 @@ class Results:
     
     def addPeaks (self, _ROI, _condition, _times, _peaks, verbose=False):
         # the peaks (and their times) are arrays of values that belong to a ROI and a condition.
+        # list of peaks will be of arbitrary length, the table is extended when it is written
         
-        # list of peaks will be of arbitrary length
-        # check that it is not too long for the dataFrame
-        if verbose: print ("addPeaks: self.df.index.size, lenpeaks:", self.df.index.size, len(_peaks) )
-        if self.df.index.size < len (_peaks):
-            _rlp = range(len(_peaks))
-            self.df = self.df.reindex(_rlp)
-                
-        # overwrite or add column if new
-        self.df[_ROI, _condition, 't'] = pd.Series(_times)
-        self.df[_ROI, _condition, 'peak'] = pd.Series(_peaks)
-        #print (self.df[_ROI, _condition, 'peak'])
+        if verbose: print ("addPeaks: {} {}, lenpeaks: {}".format(_ROI, _condition, len(_peaks)))
+        self.peakArrays[_ROI, _condition] = (np.asarray(_times, dtype=float), np.asarray(_peaks, dtype=float))
 
 
     def getPeaks (self, _ROI, _condition):
+        # returns arrays of times and peaks
+        if (_ROI, _condition) in self.peakArrays:
+            return self.peakArrays[_ROI, _condition]
+        
         # all columns except the longest end in NaN
         # "empty" columns are just NaN
-        _times = self.df[_ROI, _condition, 't'].dropna()
-        _peaks = self.df[_ROI, _condition, 'peak'].dropna()
+        _times = self.table[_ROI, _condition, 't'].dropna().to_numpy(dtype=float)
+        _peaks = self.table[_ROI, _condition, 'peak'].dropna().to_numpy(dtype=float)
         
         return _times, _peaks
 
@@ -212,7 +245,11 @@ class Dataset:
         self.GUIcontrols["autoPeaks"] = "Enable"   # a dataset can activate/deactivate parts of the GUI, activated by default
         self.ROI_list = []
         self.trace = None
-        self.peakTimes = pd.Series([])
+        self.traceArrays = {}       # (samples x ROIs) array for each condition
+        self.ROIindex = {}          # column of each ROI in the array for each condition
+        self.timeArrays = {}        # sample times for each condition (read only)
+        self.reductions = {}        # Mean and Variance traces for each condition, made when first asked for
+        self.peakTimes = np.array([])
     
     def setDSname(self, _name):
         self.DSname = _name
@@ -231,9 +268,51 @@ class Dataset:
     def addTracesToDS (self, _traces):
         #traceDF object? could just be a dictionary of data frames?
         self.traces = _traces
+        
+        # keep one contiguous array per condition so single traces are cheap views
+        # single precision for plotting and peak finding; the data frames stay double for the results and saving
+        self.traceArrays = {}
+        self.ROIindex = {}
+        self.timeArrays = {}
+        self.reductions = {}
+        for _condition, _df in _traces.items():
+            self.traceArrays[_condition] = _df.to_numpy(dtype=np.float32)
+            self.ROIindex[_condition] = {_ROI: i for i, _ROI in enumerate(_df.columns)}
+            self.timeArrays[_condition] = _df.index.to_numpy(dtype=float)
+            self.timeArrays[_condition].setflags(write=False)
+        
         self.isempty = False
         print ("addTracesToDS: added")
+    
+    def getTrace (self, _condition, _ROI):
+        # a view into the trace array, should not be modified in place
+        return self.traceArrays[_condition][:, self.ROIindex[_condition][_ROI]]
+    
+    def getTimes (self, _condition):
+        # the shared array of sample times, should not be modified in place
+        return self.timeArrays[_condition]
+    
+    def getReduction (self, _condition, _kind):
+        # "Mean" or "Variance" over the ROIs, calculated once for each condition
+        # the stored array is shared, so it is read only
+        _key = (_kind, _condition)
+        if _key not in self.reductions:
+            if _kind == "Mean":
+                _r = self.traces[_condition].mean(axis=1).to_numpy(dtype=float)
+            else:
+                _r = self.traces[_condition].var(axis=1).to_numpy(dtype=float)
+            _r.setflags(write=False)
+            self.reductions[_key] = _r
+        return self.reductions[_key]
 
+    def view (self, _traces=None):
+        # a light Dataset with this name and traces (or the ones given), for passing to dialogs
+        # nothing is copied, so the traces should not be modified in place
+        _v = Dataset(self.DSname)
+        _v.traces = self.traces if _traces is None else _traces
+        _v.isEmpty = self.isEmpty
+        return _v
+    
     def getSD (self, maskWidth=10):
         if self.isempty:
             return None
@@ -242,7 +321,7 @@ class Dataset:
             
             # need to get the peaks
             # get SD should only be called after peaks were found - should be an option
-            peakTimes = self.peakTimes.values
+            peakTimes = np.asarray(self.peakTimes)
             print ("peakTimes", peakTimes)
             for i, condition in enumerate(self.traces):
                 _stc = self.traces[condition]
@@ -1,4 +1,5 @@
 import sys
+import logging
 from PySide2 import QtCore, QtGui
 from PySide2.QtWidgets import QApplication, QMainWindow, QGridLayout, QWidget, QCheckBox, QLayout, QDialog, QLabel, QPushButton, QVBoxLayout
 import numpy as np
@@ -6,6 +7,8 @@ import pyqtgraph as pg
 import pandas as pd
 import utils
 
+logger = logging.getLogger("SAFT")
+
 
 class extractPeaksDialog(QDialog):
     def __init__(self, *args, **kwargs):
@@ -126,8 +129,8 @@ class extractPeaksDialog(QDialog):
         self.total_peaks = (N_ROI * N_Peaks).sum()
         self.N_ROI_label.setText("Extracting {} peaks from {} ROIs (total {})\n over the sets named {}".format(N_Peaks, N_ROI, self.total_peaks, tdk_display))
         
-        _printable = "{}\n{}\n".format(tdk_display, [self.tracedata[d].head() for d in tdk])
-        print ("Added data of type {}:\n{}\n".format(type(self.tracedata), _printable))
+        # the heads are only formatted if debug messages are shown
+        logger.debug("Added data of type %s:\n%s\n%s\n", type(self.tracedata), tdk_display, [self.tracedata[d].head() for d in tdk])
         self.maskLowSNR()
        
     def getRundown(self, silent=False):
@@ -192,35 +195,29 @@ class extractPeaksDialog(QDialog):
         self.prepGuiParameters()
         self.pk_extracted_by_condi = {}
         
-        for _condi in self.tracedata.keys():
-            maxVal = len(self.tPeaks)
-        
-        
-            ROI_df = self.tracedata[_condi]
-            #print (ROI_df)
-        
-            peaksList = []
-            progMsg = "Get {0} peaks, {1} set..".format(maxVal, _condi)
-            with pg.ProgressDialog(progMsg, 0, maxVal) as dlg:
-                dlg.setMinimumWidth(300)
-                for t in self.tPeaks:
-                    dlg += 1
-                    idx =  np.searchsorted(ROI_df.index, t)
-                    # avoid falling off start or end of columns
-                    e = max (idx-self.psr, 0)
-                    # zero biased so add one.
-                    l = min (idx+self.psr+1, len(ROI_df.index))
-                    print (t, e, idx, l, ROI_df.iloc[e:l])
-                    
-                    p = ROI_df.iloc[e:l].max().to_frame().transpose()
-                    peaksList.append(p)
+        maxVal = len(self.tracedata)
+        progMsg = "Get {0} peaks from {1} sets..".format(len(self.tPeaks), maxVal)
+        with pg.ProgressDialog(progMsg, 0, maxVal) as dlg:
+            dlg.setMinimumWidth(300)
+            for _condi, ROI_df in self.tracedata.items():
+                dlg += 1
+                
+                # positions of all the peaks at once
+                idx = np.searchsorted(ROI_df.index.values, self.tPeaks)
+                _arr = ROI_df.to_numpy(dtype=float)
                 
-                #stick rows together (all have same zero index...)
-                peaksdf = pd.concat(peaksList)
+                # the maximum of each ROI in the search range around each peak
+                # built up over the (few) offsets, each one a gather of rows for all peaks
+                # rows off the start or end of the columns are skipped, NaN are ignored (as pandas max)
+                _peaks = np.full((len(idx), _arr.shape[1]), np.nan)
+                for _offset in range(-self.psr, self.psr + 1):
+                    _rows = idx + _offset
+                    _inside = (_rows >= 0) & (_rows < len(_arr))
+                    _peaks[_inside] = np.fmax(_peaks[_inside], _arr[_rows[_inside]])
                 
-                # Overwrite index with the original peak positions
+                # index with the original peak positions
                 # (somewhat inexact because of the 'range')
-                peaksdf.index = self.tPeaks
+                peaksdf = pd.DataFrame(_peaks, index=self.tPeaks, columns=ROI_df.columns)
                 self.pk_extracted_by_condi[_condi] = peaksdf
         
     
@@ -565,7 +565,8 @@ class histogramFitDialog(QDialog):
             _ROI = self.current_ROI
         
         # sum data for current ROI
-        _pdata = pd.concat([pd.Series(data=self.peakResults[c][_ROI].dropna().values) for c in self.peakResults.keys()])
+        # one array, not a Series for each condition that are then concatenated
+        _pdata = np.concatenate([self.peakResults[c][_ROI].dropna().to_numpy(dtype=float) for c in self.peakResults.keys()])
         _hy, _hx  = np.histogram(_pdata, bins=_nbins, range=(-_max/5, _max))
         _hxc = np.mean(np.vstack([_hx[0:-1], _hx[1:]]), axis=0)
         
@@ -1092,7 +1093,7 @@ class histogramFitDialog(QDialog):
             
             # mega list comprehension to extract the same objects as in the preceding loop, but simultaneously for concat
     
-            _pdata = pd.concat([pd.Series(data=self.peakResults[c][_ROI].dropna().values) for c in self.peakResults.keys()])
+            _pdata = np.concatenate([self.peakResults[c][_ROI].dropna().to_numpy(dtype=float) for c in self.peakResults.keys()])
             
             #print ("_pdata: {}".format(_pdata)) # length should be 3x
             
@@ -0,0 +1,137 @@
+from functools import lru_cache
+
+import numpy as np
+import scipy.signal as scsig
+
+# numba's prange once cwtKernel has compiled the loops
+prange = range
+
+try:
+    # the ridge line steps of scipy.signal.find_peaks_cwt, so that results are the same
+    from scipy.signal._peak_finding import _identify_ridge_lines, _filter_ridge_lines
+    ridgeLinesAvailable = True
+except ImportError:
+    print ("scipy ridge line functions not found, using scipy.signal.find_peaks_cwt.")
+    ridgeLinesAvailable = False
+
+
+def ricker(points, a):
+    """Ricker (Mexican hat) wavelet, as used by scipy.signal.find_peaks_cwt"""
+    A = 2 / (np.sqrt(3 * a) * (np.pi ** 0.25))
+    wsq = a ** 2
+    vec = np.arange(0, points) - (points - 1.0) / 2
+    xsq = vec ** 2
+    mod = (1 - xsq / wsq)
+    gauss = np.exp(-xsq / (2 * wsq))
+    return A * mod * gauss
+
+def rickerKernels(widths, T):
+    """Ricker wavelets for each width, zero padded to the longest, with their lengths"""
+
+    lengths = np.array([min(10 * w, T) for w in widths], dtype=np.intp)
+    kernels = np.zeros((len(widths), lengths.max()))
+    for i, w in enumerate(widths):
+        # the wavelet is symmetric so it does not need to be reversed for convolution
+        kernels[i, :lengths[i]] = ricker(lengths[i], w)
+    return kernels, lengths
+
+def _cwtBatch(traces, kernels, lengths):
+    """direct convolution, equivalent to np.convolve(trace, kernel, mode='same')"""
+    T, n = traces.shape
+    nw = kernels.shape[0]
+    out = np.empty((nw, T, n))
+    for j in prange(n):
+        for w in range(nw):
+            N = lengths[w]
+            h = (N - 1) // 2
+            for i in range(T):
+                acc = 0.
+                for m in range(N):
+                    k = i + h - m
+                    if k >= 0 and k < T:
+                        acc += traces[k, j] * kernels[w, m]
+                out[w, i, j] = acc
+    return out
+
+@lru_cache(maxsize=1)
+def cwtKernel():
+    """_cwtBatch compiled by numba (or loaded from its cache), parallel over traces, or None without numba
+    numba is only imported for the first wavelet transform, not at startup"""
+    
+    global prange
+    try:
+        import numba
+    except ImportError:
+        print ("numba not found, using scipy for the wavelet transform.")
+        return None
+    prange = numba.prange
+    return numba.njit(parallel=True, cache=True)(_cwtBatch)
+
+def cwt(traces, widths):
+    """Ricker wavelet transform of each column of traces (samples x traces)
+    Returns an array of widths x samples x traces"""
+
+    traces = np.asarray(traces, dtype=float)
+    T = traces.shape[0]
+    kernels, lengths = rickerKernels(widths, T)
+
+    _kernel = cwtKernel()
+    if _kernel is not None:
+        return _kernel(np.ascontiguousarray(traces), kernels, lengths)
+
+    # all traces are convolved with each wavelet in one call
+    out = np.empty((len(widths),) + traces.shape)
+    for i in range(len(widths)):
+        out[i] = scsig.fftconvolve(traces, kernels[i, :lengths[i]][:, None], mode='same', axes=0)
+    return out
+
+def find_peaks_cwt(traces, widths, min_snr=1, noise_perc=10):
+    """Peak finding by wavelet transform, with the same defaults as scipy.signal.find_peaks_cwt
+    traces can be 1-D, or 2-D (samples x traces) to do the transform for all traces together.
+    Returns the peak indices, or a list of peak indices for each column of 2-D input"""
+
+    traces = np.asarray(traces, dtype=float)
+    widths = np.atleast_1d(np.asarray(widths))
+    single = traces.ndim == 1
+    if single:
+        traces = traces[:, None]
+
+    if not ridgeLinesAvailable:
+        peaks = [scsig.find_peaks_cwt(traces[:, j], widths, min_snr=min_snr, noise_perc=noise_perc) for j in range(traces.shape[1])]
+        return peaks[0] if single else peaks
+
+    cwt_dat = cwt(traces, widths)
+    gap_thresh = np.ceil(widths[0])
+    max_distances = widths / 4.0
+
+    peaks = []
+    for j in range(traces.shape[1]):
+        ridge_lines = _identify_ridge_lines(cwt_dat[:, :, j], max_distances, gap_thresh)
+        filtered = _filter_ridge_lines(cwt_dat[:, :, j], ridge_lines, min_snr=min_snr, noise_perc=noise_perc)
+        max_locs = np.asarray([x[1][0] for x in filtered], dtype=np.intp)
+        max_locs.sort()
+        peaks.append(max_locs)
+
+    return peaks[0] if single else peaks
+
+def removeSmallPeaks(traces, peaks, percent):
+    """Drop peaks smaller than percent of the maximum of their trace
+    traces and peaks as for find_peaks_cwt output (1-D and indices, or 2-D and a list of indices).
+    For 2-D input, the peaks of all traces are compared in one pass"""
+
+    traces = np.asarray(traces, dtype=float)
+    if traces.ndim == 1:
+        peaks = np.asarray(peaks, dtype=np.intp)
+        return peaks[traces[peaks] > percent * traces.max() / 100.0]
+
+    counts = [len(p) for p in peaks]
+    if sum(counts) == 0:
+        return peaks
+    allPeaks = np.concatenate(peaks).astype(np.intp)
+    # the column that each peak came from
+    cols = np.repeat(np.arange(len(peaks)), counts)
+    cutOffs = percent * traces.max(axis=0) / 100.0
+    keep = traces[allPeaks, cols] > cutOffs[cols]
+    # split the kept peaks back into their traces
+    ends = np.cumsum(np.bincount(cols[keep], minlength=len(peaks)))
+    return np.split(allPeaks[keep], ends[:-1])
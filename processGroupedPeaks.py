@@ -1,12 +1,18 @@
 import sys
 import os.path
 import itertools
+import logging
+import warnings
 from PySide2 import QtCore, QtGui
 from PySide2.QtWidgets import QApplication, QMainWindow, QGridLayout, QWidget, QPushButton, QLayout, QDialog, QLabel, QRadioButton, QVBoxLayout, QFileDialog
 import numpy as np
 import pyqtgraph as pg
 import pandas as pd
 
+import utils
+
+logger = logging.getLogger("SAFT")
+
 def sanitizeList(l):
     return [x.strip().replace(' ', '_').replace('.', '_').replace('(', '').replace(')', '') for x in l]
 
@@ -103,19 +109,19 @@ class groupPeakDialog(QDialog):
         # updated for openpyxl
         
         if self.filename:
-            with pd.ExcelWriter(self.filename) as writer:
-                #save peaks into sheet
-                for _set, _df in self.groupsextracted_by_set.items():
+            # rows are streamed to the file, the workbook starts without sheets
+            wb = utils.streamWorkbook(self.filename)
+            #save peaks into sheet
+            for _set, _df in self.groupsextracted_by_set.items():
+                _worksheet = wb.create_sheet(_set)
                 
-                    _df.to_excel(writer, sheet_name=_set, startrow=1, header=False)
-                    #_workbook  = writer.book
-                    _worksheet = writer.sheets[_set]
-                    #header_format = _workbook.add_format(self.hform)
-                    for col_num, v in enumerate(_df.columns.values):
-                        #print (col_num, value, _set)
-                        # redone for openpyxl syntax
-                        _worksheet.cell(1, col_num + 2).value = str(v[0]) + " " + _set
-                        _worksheet.cell(2, col_num + 2).value = str(v[1])
+                # two header rows (ROI and statistic), each built once and appended whole
+                _ROIheader = [None] + [str(v[0]) + " " + _set for v in _df.columns.values]
+                _statHeader = [None] + [str(v[1]) for v in _df.columns.values]
+                _worksheet.append(_ROIheader)
+                utils.appendSheetRows(_worksheet, _statHeader, _df.index.values, _df.values)
+            
+            wb.save()
            
             if verbose: print ("Saved {}".format(self.filename))
         
@@ -222,23 +228,22 @@ class groupPeakDialog(QDialog):
         """Bring in external dataset for analysis"""
         self.peakData = d.resultsDF     #resultsDF object
         self.name = d.name
-        print (self.peakData)
+        logger.debug("Peak data: %s", self.peakData)
         
         # the following was designed for a dictionary, maybe fails with resultsDF object
         # remove any duplicate peaks
         for k, _v in self.peakData.items():
-            _wasShape = _v.shape
-            self.peakData[k] = _v.loc[~_v.index.duplicated(keep='first')] #StackOverflow 13035764
-            _isShape = _v.shape
-            if _isShape != _wasShape:
-                print ("Removed duplicates, df.shape() was {}, now {}".format(_wasShape, _isShape))
+            # is_unique is cached by the index, so the mask is only built when there are duplicates
+            if not _v.index.is_unique:
+                self.peakData[k] = _v.iloc[~_v.index.duplicated(keep='first')] #StackOverflow 13035764
+                print ("Removed duplicates, df.shape() was {}, now {}".format(_v.shape, self.peakData[k].shape))
             
         pdk = self.peakData.keys()
         pdk_display = ", ".join(str(k) for k in pdk)
         N_ROI = [len (self.peakData[d].columns) for d in pdk]
         
-        _printable = "{}\n{}\n".format(pdk_display, [self.peakData[d].head() for d in pdk])
-        print ("Added data {} of type {}:\n{}\n".format(self.name, type(self.peakData), _printable))
+        # the heads are only formatted if debug messages are shown
+        logger.debug("Added data %s of type %s:\n%s\n%s\n", self.name, type(self.peakData), pdk_display, [self.peakData[d].head() for d in pdk])
         
         self.dataLoaded = True
         self.N_ROI_label.setText("Grouping peaks from {} ROIs \n over the sets named {}".format(N_ROI, pdk_display))
@@ -258,21 +263,15 @@ class groupPeakDialog(QDialog):
  
         #remove any duplicate peaks
         for k, _v in self.peakData.items():
-            _wasShape = _v.shape
-            self.peakData[k] = _v.loc[~_v.index.duplicated(keep='first')] # StackOverflow 13035764
-            _isShape = _v.shape
-            if _isShape != _wasShape:
-                if verbose: print ("Removed duplicates, df.shape() was {}, now {}".format(_wasShape, _isShape))
+            if not _v.index.is_unique:
+                self.peakData[k] = _v.iloc[~_v.index.duplicated(keep='first')] # StackOverflow 13035764
+                if verbose: print ("Removed duplicates, df.shape() was {}, now {}".format(_v.shape, self.peakData[k].shape))
             
         pdk = self.peakData.keys()
         pdk_display = ", ".join(str(k) for k in pdk)
         N_ROI = [len (self.peakData[d].columns) for d in pdk]
         
-        _printable = ""
-        for k, v in self.peakData.items():
-            _printable += ("{}\n{}\n.....\n".format(k, v.head()))
-        
-        if verbose: print ("Added self.peakData of type: {}\n{}".format(type(self.peakData), _printable))
+        if verbose: logger.debug("Added self.peakData of type: %s\n%s", type(self.peakData), [(k, v.head()) for k, v in self.peakData.items()])
         
         self.dataLoaded = True
         self.N_ROI_label.setText("Grouping peaks from {} dataset: {} ROIs \n over the conditions {}".format(self.name, N_ROI, pdk_display))
@@ -286,39 +285,37 @@ class groupPeakDialog(QDialog):
         self.prepGuiParameters()
         self.groupsextracted_by_set = {}
         #_step  = int(self.groupNSB.value())
-        All = slice(None)
        
         
         for _set in self.peakData.keys():
             # prep means and sd frames
             _c = self.peakData[_set].columns
-            if verbose: print("_c, self.step \n{}\t{}".format(_c, self.step))
+            if verbose: logger.debug("_c, self.step \n%s\t%s", _c, self.step)
             
             
             _stat = ['mean','SD']
             _headr = list(itertools.product(_c, _stat))
             # make dataframe
             cols = pd.MultiIndex.from_tuples(_headr)
-            _s = pd.DataFrame([], range(self.step), cols)
-            if verbose: print ("_s: {}".format(_s))
             
-            for p in range(self.step):
-                # get pth row group
-                _subset = self.peakData[_set].iloc[p::self.step]
-                if verbose: print ("{0}. subset\n {1}\n".format(p + 1, _subset))
-                
-                _ssmean = _subset.describe().loc['mean']
-                _ssSD = _subset.describe().loc['std']
-                # each set of paired mean, sd results is assigned to two columns
-                
-                pth_row = _s.index.isin(_s.index[p:p+1])
-                if verbose: print ("pth row: {0}\nempty\n {1}\n describe.transposed\n{2}\n".format(pth_row, _s.loc[pth_row, (All, 'mean')] , _ssmean.transpose()))
-                
-                _ROI_cols = [str(x) for x in _ssmean.index.values]
-                
-                _s.loc[pth_row, (_ROI_cols, 'mean')] = _ssmean.values       
-                _s.loc[pth_row, (_ROI_cols, 'SD')] = _ssSD.values
-
+            # rows p, p + step, p + 2*step... form the pth group
+            # pad with NaN to whole groups, then all groups and ROIs are reduced at once
+            _arr = self.peakData[_set].to_numpy(dtype=float)
+            _nRows = -(-_arr.shape[0] // self.step) * self.step
+            _padded = np.full((_nRows, _arr.shape[1]), np.nan)
+            _padded[:_arr.shape[0]] = _arr
+            _grouped = _padded.reshape(-1, self.step, _arr.shape[1])     # (repeats, step, ROIs)
+            
+            with warnings.catch_warnings():
+                # groups that are empty or have a single peak give NaN, as with describe()
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                _means = np.nanmean(_grouped, axis=0)
+                _SDs = np.nanstd(_grouped, axis=0, ddof=1)
+            
+            # each set of paired mean, sd results is assigned to two columns
+            _s = pd.DataFrame(np.stack((_means, _SDs), axis=2).reshape(self.step, -1), range(self.step), cols)
+            if verbose: logger.debug("_s: %s", _s)
+            
             self.groupsextracted_by_set[_set] = _s
         
         # we can save now that we have data
@@ -338,7 +335,7 @@ class groupPeakDialog(QDialog):
         if self.dataLoaded:
             try:
                 _firstdf = list(self.peakData.values())[0]
-                if verbose: print ("first DF,\n", _firstdf)
+                if verbose: logger.debug("first DF,\n%s", _firstdf)
                 self.peaksN = _firstdf.shape[0]     # get the number of rows in the first DataFrame
             except:
                 if verbose: print ("couldn't find a dataframe in self.peakData")
@@ -129,6 +129,21 @@ def nGaussians(x, n, spacing, widths, *heights):
         
     return g
     
+def nGaussians_jac(x, n, spacing, widths, *heights):
+    """derivatives of nGaussians with respect to spacing, widths and each height
+    returns an array of len(x) x (n + 2)"""
+    
+    x = np.asarray(x, dtype=float)
+    u = x[:, None] - np.arange(n) * spacing          # distance from each centre
+    g = 0.399 / widths * np.exp(-u**2 / (2 * widths ** 2))
+    hg = g * np.asarray(heights[:n])
+    
+    jac = np.empty((len(x), n + 2))
+    jac[:, 0] = (hg * u * np.arange(n)).sum(axis=1) / widths ** 2
+    jac[:, 1] = (hg * (u**2 / widths ** 3 - 1 / widths)).sum(axis=1)
+    jac[:, 2:] = g
+    return jac
+
 def fit_nGaussians (num, q, ws, hy, hx):
     """heights are fitted"""
     
@@ -137,9 +152,11 @@ def fit_nGaussians (num, q, ws, hy, hx):
     guesses = np.array([q, ws, *h])
 
     errfunc = lambda pa, x, y: (nGaussians(x, num, *pa) - y)**2
+    # analytic derivatives of the squared residuals, rather than finite differences
+    jacfunc = lambda pa, x, y: 2 * (nGaussians(x, num, *pa) - y)[:, None] * nGaussians_jac(x, num, *pa)
 
     # loss="soft_l1" is bad!
-    return optimize.least_squares(errfunc, guesses, bounds = (0, np.inf), args=(hx, hy))
+    return optimize.least_squares(errfunc, guesses, jac=jacfunc, bounds = (0, np.inf), args=(hx, hy))
 
 def globalErrFuncBW(pa, num, ws, nh, hx, hy):
     """global binomial stats fit with fixed ws"""
@@ -5,6 +5,10 @@ import sys
 import os.path
 import string
 import random
+import json
+import importlib
+from functools import lru_cache
+from itertools import zip_longest
 
 import pandas as pd
 import numpy as np
@@ -13,6 +17,16 @@ import pyqtgraph as pg
 
 from PySide2 import QtGui
 
+@lru_cache(maxsize=None)
+def optionalImport(name, missing):
+    """Optional module, imported when it is first needed rather than at start up
+    Returns None (and prints missing, once) if it is not installed"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        print (missing)
+        return None
+
 class txOutput():
     """Console frame"""
     def __init__(self, initialText, *args, **kwargs):
@@ -43,6 +57,44 @@ class txOutput():
         self.appendOutText(initialText)
 
 
+class streamWorkbook():
+    """New xlsx file, with sheets that rows are appended to in order (as a write only openpyxl workbook)
+    xlsxwriter is used in constant memory mode if it is available"""
+    def __init__(self, filename):
+        
+        self.filename = filename
+        # constant memory xlsx writing
+        self.xlsxwriter = optionalImport("xlsxwriter", "xlsxwriter not found, using openpyxl to save workbooks.")
+        if self.xlsxwriter:
+            self.wb = self.xlsxwriter.Workbook(filename, {'constant_memory': True})
+        else:
+            from openpyxl import Workbook
+            self.wb = Workbook(write_only=True)
+    
+    def create_sheet(self, name):
+        if self.xlsxwriter:
+            return streamSheet(self.wb.add_worksheet(name))
+        return self.wb.create_sheet(name)
+    
+    def save(self):
+        if self.xlsxwriter:
+            self.wb.close()
+        else:
+            self.wb.save(self.filename)
+
+
+class streamSheet():
+    """xlsxwriter worksheet with ws.append, as for openpyxl"""
+    def __init__(self, ws):
+        
+        self.ws = ws
+        self.row = 0
+    
+    def append(self, values):
+        self.ws.write_row(self.row, 0, values)
+        self.row += 1
+
+
 def extendMaskArray(series, r):
     """series should be a list of indices, r is the width"""
     new = []
@@ -83,6 +135,194 @@ def decomposeRDF(rdf):
 
     return decomposed
 
+def binIndex(vals, nbins, hmax):
+    """Bin of each value for nbins regular bins from 0 to hmax, decided against the bin edges as np.histogram does
+    (so a value on an edge that is not exact in floating point lands in the same bin). Values at hmax go into
+    the last bin. Returns the bin indices and a mask of the values in range"""
+    
+    vals = np.asarray(vals, dtype=float)
+    edges = np.linspace(0., hmax, nbins + 1)
+    inRange = (vals >= 0.) & (vals <= hmax)
+    idx = np.zeros(vals.shape, dtype=np.intp)
+    idx[inRange] = (vals[inRange] * (nbins / hmax)).astype(np.intp)
+    idx[idx == nbins] = nbins - 1
+    # the multiplication can be one bin out next to an edge
+    idx[inRange & (vals < edges[idx])] -= 1
+    idx[inRange & (vals >= edges[idx + 1]) & (idx != nbins - 1)] += 1
+    return idx, inRange
+
+def histogramColumns(data, nbins, hmax):
+    """Histogram each column of data (values x columns) into the same regular bins from 0 to hmax
+    NaN are ignored. Counts are the same as np.histogram(column, nbins, (0, hmax)).
+    Returns the counts as an array of bins x columns"""
+    
+    data = np.asarray(data, dtype=float)
+    nCols = data.shape[1]
+    # every value is binned together with the index of its column
+    cols = np.broadcast_to(np.arange(nCols), data.shape)
+    idx, inRange = binIndex(data, nbins, hmax)
+    idx = idx[inRange]
+    cols = cols[inRange]
+    
+    # threaded filling of many histograms at once
+    bh = optionalImport("boost_histogram", "boost-histogram not found, using numpy for ROI histograms.")
+    if bh is not None:
+        h = bh.Histogram(bh.axis.Integer(0, nbins), bh.axis.Integer(0, nCols))
+        # threads only pay off for many values, not for the histograms on show
+        h.fill(idx, cols, threads=os.cpu_count() if idx.size > 100000 else None)
+        return h.view()
+    
+    counts = np.bincount(idx * nCols + cols, minlength=nbins * nCols)
+    return counts.reshape(nbins, nCols)
+
+def appendSheetRows(ws, header, index, values):
+    """Write a header row, then one row per index entry with its values, to an openpyxl worksheet
+    Rows are appended in order, so ws can belong to a write_only workbook or a streamWorkbook.
+    index and values can have different lengths (e.g. bin edges beside histogram counts)"""
+    
+    ws.append(header)
+    # plain python values, one list per row, with NaN and +/-inf as empty cells
+    # (xlsxwriter cannot write them)
+    _index = np.asarray(index).tolist()
+    _values = np.asarray(values)
+    if _values.dtype.kind == 'f':
+        _values = np.where(np.isfinite(_values), _values, None)
+    _rows = _values.tolist()
+    for _i, _row in zip_longest(_index, _rows):
+        ws.append([_i] + (_row or []))
+
+def mangleHeader(header):
+    """Column names as pandas makes them from a header row: blank names become "Unnamed: i" (i is the position)
+    and repeats of a name get ".1", ".2"... Raises ValueError for names that are not strings or numbers"""
+    
+    _names = []
+    for i, _name in enumerate(header):
+        if _name is None or (isinstance(_name, str) and _name.strip() == ""):
+            _name = "Unnamed: {}".format(i)
+        elif isinstance(_name, bool) or not isinstance(_name, (str, int, float)):
+            raise ValueError("header cell {} is not a name: {!r}".format(i, _name))
+        _names.append(_name)
+    
+    _counts = {}
+    _taken = set(_names)
+    for i, _name in enumerate(_names):
+        _n = _counts.get(_name, 0)
+        if _n > 0:
+            # the same scheme as pandas: try name.n until it is not used
+            _new = "{}.{}".format(_name, _n)
+            while _new in _taken:
+                _n += 1
+                _new = "{}.{}".format(_name, _n)
+            _taken.add(_new)
+            _names[i] = _new
+        _counts[_name] = _n + 1
+    
+    return _names
+
+def sheetToFrame(ws):
+    """Read an openpyxl worksheet of numbers into a dataframe, first column as the index (as read_excel with index_col=0)
+    Empty cells become NaN, empty rows and columns after the data (e.g. formatted cells) are dropped.
+    Raises ValueError if there are cells that are not numbers, or header cells that are not names"""
+    
+    # rows can be ragged when the sheet does not record its dimensions
+    _rows = [list(r) for r in ws.values]
+    
+    # trim trailing rows and columns that have no values
+    while _rows and all(v is None for v in _rows[-1]):
+        _rows.pop()
+    if not _rows:
+        return pd.DataFrame()
+    _width = max(max((i + 1 for i, v in enumerate(r) if v is not None), default=0) for r in _rows)
+    _rows = [r[:_width] + [None] * (_width - len(r)) for r in _rows]
+    
+    _header = _rows[0]
+    _names = mangleHeader(_header)
+    # a blank index header gives an unnamed index, as in pandas
+    _indexName = None if _header[0] is None else _names[0]
+    
+    # None (empty cells) converts to NaN, other cells (text, dates) fail
+    try:
+        data = np.array(_rows[1:], dtype=float).reshape(-1, _width)
+    except TypeError as e:
+        raise ValueError(str(e))
+    index = pd.Index(data[:, 0], name=_indexName)
+    return pd.DataFrame(data[:, 1:], index=index, columns=_names[1:])
+
+def readSheet(filename, sheetName):
+    """Read one sheet of an xlsx file with its own read only workbook, so that sheets can be read in parallel"""
+    
+    from openpyxl import load_workbook
+    
+    wb = load_workbook(filename, read_only=True, data_only=True)
+    try:
+        return sheetToFrame(wb[sheetName])
+    except ValueError:
+        return pd.read_excel(filename, sheet_name=sheetName, index_col=0)
+    finally:
+        # read only workbooks keep the file open
+        wb.close()
+
+def readWorkbook(filename):
+    """Read all sheets of an xlsx file into a dictionary of dataframes, like pd.read_excel(filename, None, index_col=0)
+    The cells are streamed (read only) rather than loading the whole workbook, and the sheets are read in parallel.
+    Falls back to pandas for other file types, or for sheets that are not all numbers"""
+    
+    from concurrent.futures import ThreadPoolExecutor
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+    from zipfile import BadZipFile
+    
+    try:
+        wb = load_workbook(filename, read_only=True, data_only=True)
+    except (InvalidFileException, BadZipFile):
+        return pd.read_excel(filename, None, index_col=0)
+    _names = wb.sheetnames
+    wb.close()
+    
+    if len(_names) < 2:
+        return {_name: readSheet(filename, _name) for _name in _names}
+    
+    # each worker opens the file separately, the sheets are independent
+    with ThreadPoolExecutor(max_workers=min(8, len(_names))) as _pool:
+        _frames = _pool.map(lambda _name: readSheet(filename, _name), _names)
+        return dict(zip(_names, _frames))
+
+def readTraceWorkbook(filename):
+    """Read all sheets of a workbook of traces, as readWorkbook, using a parquet sidecar file when it is up to date
+    The sidecar (filename + ".parquet") is written after the workbook is parsed, and is ignored once the workbook is newer"""
+    
+    _sidecar = filename + ".parquet"
+    # parquet sidecar files, so that workbooks reload quickly
+    pyarrow = optionalImport("pyarrow", "pyarrow not found, workbooks will be parsed every time they are opened.")
+    if pyarrow:
+        import pyarrow.parquet as pq
+    
+    if pyarrow and os.path.exists(_sidecar) and os.path.getmtime(_sidecar) >= os.path.getmtime(filename):
+        try:
+            _table = pq.read_table(_sidecar)
+            # the column order of each sheet, which the combined frame cannot hold
+            _columns = json.loads(_table.schema.metadata[b"SAFTcolumns"])
+            _all = _table.to_pandas()
+            return {_k: _all.xs(_k, level="condition")[_c] for _k, _c in _columns.items()}
+        except Exception as e:
+            print ("Could not use {0}, reading the workbook. ({1})".format(_sidecar, e))
+    
+    _sheets = readWorkbook(filename)
+    
+    if pyarrow and _sheets:
+        try:
+            _all = pd.concat(_sheets, names=["condition"])
+            _table = pyarrow.Table.from_pandas(_all)
+            # kept in the parquet schema, which older pandas (without DataFrame.attrs) can also read back
+            _meta = dict(_table.schema.metadata or {})
+            _meta[b"SAFTcolumns"] = json.dumps({_k: list(_v.columns) for _k, _v in _sheets.items()}).encode()
+            pq.write_table(_table.replace_schema_metadata(_meta), _sidecar)
+        except Exception as e:
+            # e.g. a read only folder, or column names that are not strings
+            print ("Could not write {0}. ({1})".format(_sidecar, e))
+    
+    return _sheets
+
 def getFileStem(_name):
 
     _split = os.path.split(_name)